@@ -1,8 +1,16 @@
 # main.py
 
 import google.generativeai as genai
+import argparse
+import datetime
+import hashlib
 import json
 import os
+import re
+import sys
+import time
+
+from fetch_cache import FetchCache, make_key
 
 # --- Configuration ---
 # 1. Install the library:
@@ -12,8 +20,22 @@ import os
 #    It's recommended to set it as an environment variable for security.
 #    Alternatively, you can uncomment the next line and paste your key directly.
 #    genai.configure(api_key="YOUR_API_KEY")
+#    The key is only needed when a report is actually generated (see get_model).
+
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-pro-latest")
+
+# Finished reports are cached on disk, keyed by model, system prompt, request and
+# report week, so re-running only to redo the file output costs nothing, while next
+# week's run always generates a fresh report.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") not in ("0", "false", "no")
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
 
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# With --context-cache the system instruction is stored once with the API's context
+# caching and shared by every variant (and later runs) until it expires.
+CONTEXT_CACHE_MODEL = os.getenv("GEMINI_CONTEXT_CACHE_MODEL", "models/gemini-1.5-pro-001") # context caching needs a fixed model version
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
 
 # --- System Prompt Definition ---
 # This is the updated JSON object with instructions for Tilda-ready format,
@@ -106,28 +128,188 @@ SYSTEM_PROMPT = {
   }
 }
 
+# Sent as compact JSON; its hash is part of every cache key.
+SYSTEM_INSTRUCTION = json.dumps(SYSTEM_PROMPT, ensure_ascii=False, separators=(",", ":"))
+SYSTEM_PROMPT_HASH = hashlib.sha256(SYSTEM_INSTRUCTION.encode("utf-8")).hexdigest()
+
 # --- Model Initialization ---
-model = genai.GenerativeModel(
-    model_name="gemini-1.5-pro-latest",
-    system_instruction=SYSTEM_PROMPT
-)
+_models = {}
+
+def get_model(context_cache=False):
+    """
+    (model, model_name), configured and built on first use. With
+    `context_cache` the model is backed by a cached system instruction when
+    the API allows it, and falls back to a regular model otherwise.
+    """
+    key = "cached" if context_cache else "plain"
+    if key not in _models:
+        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+        model = load_cached_model() if context_cache else None
+        _models[key] = (model, CONTEXT_CACHE_MODEL) if model else (genai.GenerativeModel(model_name=MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION), MODEL_NAME)
+    return _models[key]
+
+def load_cached_model():
+    """Model backed by the API context cache of the system instruction (reused while it lives), or None."""
+    display_name = f"axionym-{SYSTEM_PROMPT_HASH[:16]}"
+    try:
+        cached = next((c for c in genai.caching.CachedContent.list() if c.display_name == display_name and c.model == CONTEXT_CACHE_MODEL), None)
+        if cached is None:
+            cached = genai.caching.CachedContent.create(model=CONTEXT_CACHE_MODEL, display_name=display_name, system_instruction=SYSTEM_INSTRUCTION,
+                                                        ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL))
+            print(f"🧠 Cached the system instruction as {cached.name} for {CONTEXT_CACHE_TTL}s")
+        else:
+            print(f"🧠 Reusing cached system instruction {cached.name}")
+        return genai.GenerativeModel.from_cached_content(cached_content=cached)
+    except Exception as e:
+        # e.g. the prompt is below the API's minimum cacheable size, or the model does not support caching
+        print(f"⚠️ Context caching unavailable ({e}); sending the system instruction with each request.")
+        return None
+
+def report_period(today=None):
+    """ISO week the report covers, e.g. "2024-W07"."""
+    year, week, _ = (today or datetime.date.today()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+def cache_key(model_name, user_request, period=None):
+    return make_key("gemini", model_name, {"system_prompt": SYSTEM_PROMPT_HASH, "request": user_request, "period": period or report_period()})
+
+def make_response_cache():
+    """Builds the cache configured by the RESPONSE_CACHE_* variables, or None when caching is disabled."""
+    return FetchCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES) if RESPONSE_CACHE_ENABLED else None
 
 # --- Generation ---
-print("🚀 Starting content generation process...")
+OUTPUT_FILE = "cybercrime_report_tilda.md"
+
+def report_speed(started, first_token_at, finished, token_count):
+    """
+    Prints time-to-first-token, then throughput over the time spent generating
+    (from the first token on when streaming) and the total time.
+    """
+    if first_token_at is not None:
+        print(f"⏱️ Time to first token: {first_token_at - started:.2f}s")
+    generation_time = finished - (first_token_at or started)
+    if token_count and generation_time > 0:
+        print(f"⚡ {token_count} tokens in {generation_time:.2f}s ({token_count / generation_time:.1f} tokens/sec), {finished - started:.2f}s in total")
+
+def count_output_tokens(response, text):
+    """Output token count from the API's usage metadata, or a ~4 chars/token estimate."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "candidates_token_count", None) or len(text) // 4
+
+def generate_streaming(model, user_request, output_path):
+    """
+    Streams the report to stdout and `output_path` chunk by chunk as it is
+    generated. Returns the text, or None. Ctrl+C leaves the partial report in
+    place and is re-raised, so the caller stops too.
+    """
+    started, first_token_at, parts = time.perf_counter(), None, []
+    print("\n--- ✅ Generated Report (streaming) ---")
+    try:
+        with open(output_path, "w", encoding="utf-8") as f:
+            response = model.generate_content(user_request, stream=True)
+            for chunk in response:
+                text = chunk.text
+                if first_token_at is None: first_token_at = time.perf_counter()
+                parts.append(text)
+                f.write(text)
+                f.flush()
+                sys.stdout.write(text)
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        print(f"\n\n🛑 Generation aborted. Partial report left in {output_path}")
+        raise
+    except Exception as e:
+        print(f"\n❌ Error during generation: {e}")
+        return None
+    print("\n--------------------------")
+    text = "".join(parts)
+    report_speed(started, first_token_at, time.perf_counter(), count_output_tokens(response, text))
+    print(f"\n📄 Report successfully saved to {output_path}")
+    return text
+
+def generate_blocking(model, user_request, output_path):
+    """Waits for the whole report, then prints and saves it. Returns the text, or None."""
+    started = time.perf_counter()
+    try:
+        response = model.generate_content(user_request)
+        text = response.text
+    except Exception as e:
+        print(f"\n❌ Error during generation: {e}")
+        return None
+    finished = time.perf_counter()
+
+    print("\n--- ✅ Generated Report ---")
+    print(text)
+    print("--------------------------")
+    report_speed(started, None, finished, count_output_tokens(response, text))
+    return text if save_report(text, output_path) else None
+
+def save_report(text, output_path):
+    # Save the output to a markdown file
+    try:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"\n📄 Report successfully saved to {output_path}")
+        return True
+    except Exception as e:
+        print(f"\n❌ Error saving file: {e}")
+        return False
+
+# --- Variants ---
+BASE_REQUEST = "Generate this week's cybercrime report."
+
+def build_variants(languages, audiences):
+    """One (user_request, output_path) per language/audience combination; none given means the default report."""
+    variants = []
+    for language in languages or [None]:
+        for audience in audiences or [None]:
+            request, suffix = BASE_REQUEST, []
+            if language:
+                request += f" Write the whole report in {language} instead of the language given in output_format."
+                suffix.append(language)
+            if audience:
+                request += f" Address it to this audience: {audience}."
+                suffix.append(audience)
+            slug = re.sub(r"[^a-z0-9]+", "-", "-".join(suffix).lower()).strip("-")
+            root, ext = os.path.splitext(OUTPUT_FILE)
+            variants.append((request, f"{root}.{slug}{ext}" if slug else OUTPUT_FILE))
+    return variants
+
+def generate_report(user_request, output_path, cache=None, stream=True, context_cache=False, refresh=False):
+    """Serves the report from the response cache when possible, otherwise generates it and caches the result."""
+    if cache and not refresh:
+        # Responses from either model are equally good for redoing the output
+        for model_name in ([CONTEXT_CACHE_MODEL] if context_cache else []) + [MODEL_NAME]:
+            cached = cache.get(cache_key(model_name, user_request))
+            if cached and cached['fresh']:
+                print(f"♻️ Using the cached response for {output_path} (--refresh to regenerate)")
+                return save_report(cached['body'].decode("utf-8"), output_path)
 
-user_request = "Generate this week's cybercrime report."
+    model, model_name = get_model(context_cache)
+    text = (generate_streaming if stream else generate_blocking)(model, user_request, output_path)
+    if text is None: return False
+    if cache: cache.put(cache_key(model_name, user_request), text.encode("utf-8"), content_type="text/markdown")
+    return True
 
-response = model.generate_content(user_request)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the weekly cybercrime report with Gemini.")
+    parser.add_argument("--no-stream", action="store_true", help="wait for the full response instead of streaming it")
+    parser.add_argument("--language", action="append", default=[], help="report language; repeat for several variants")
+    parser.add_argument("--audience", action="append", default=[], help="target audience; repeat for several variants")
+    parser.add_argument("--context-cache", action="store_true", help="share the system instruction between requests with the API's context caching")
+    parser.add_argument("--refresh", action="store_true", help="ignore cached responses and generate again")
+    args = parser.parse_args(argv)
 
-print("\n--- ✅ Generated Report ---")
-print(response.text)
-print("--------------------------")
+    print("🚀 Starting content generation process...")
+    cache = make_response_cache()
+    results = []
+    try:
+        for request, output_path in build_variants(args.language, args.audience):
+            results.append(generate_report(request, output_path, cache, stream=not args.no_stream, context_cache=args.context_cache, refresh=args.refresh))
+    except KeyboardInterrupt:
+        print("🛑 Aborted; no further variants were generated.")
+        return 130
+    return 0 if all(results) else 1
 
-# Save the output to a markdown file
-try:
-    with open("cybercrime_report_tilda.md", "w", encoding="utf-8") as f:
-        f.write(response.text)
-    print("\n📄 Report successfully saved to cybercrime_report_tilda.md")
-except Exception as e:
-    print(f"\n❌ Error saving file: {e}")
-    
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
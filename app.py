@@ -1,132 +1,258 @@
 # app.py
 
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, Response
 import json
+import time
 import digest_logic as dl
+from workflow_store import LazyResults, make_workflow_store
+from jobs import JobRunner, JOB_RESULT_KEY
+import dedup
+import tracing
+from tracing import tracer, format_sample
 
 app = Flask(__name__)
 # A secret key is required to use sessions
 app.secret_key = 'a_very_secret_key_for_the_axionym_digest_sessions'
 
-# We no longer need a global variable, we will use the session object
-# workflow_state = {}
+# The session cookie only carries a workflow ID; the workflow itself lives in the store.
+store = make_workflow_store()
+# Steps 1-3 run in the background; routes return at once and the page polls /status/<job_id>.
+job_runner = JobRunner(store, on_error=lambda workflow_id, message: update_workflow(workflow_id, message=message, message_type="error"))
+STEP_BUSY_MESSAGE = "Another step is still running. Wait for it to finish."
+# Stories of finished (step 4) digests; step 1 ranks them below fresh candidates.
+covered_stories = dedup.make_story_history()
 
-def get_default_prompts():
-    # ... This function remains the same ...
-    prompts = { "step1": json.dumps({ "task": "find_articles", "query": "latest digital fraud and cybercrime news", "parameters": { "timeframe": "last_7_days", "num_articles": 10, "sort_by": "relevance" } }, indent=2), "step2": json.dumps({ "task": "select_best_articles", "selection_count": 5, "criteria": { "prioritize": ["new threats", "major financial impact"], "avoid": ["reposts"] } }, indent=2), "step3": json.dumps({ "task": "generate_analytical_note", "articles_data": "PLACEHOLDER", "output_format": { "title": "Beyond the Breach: Why Digital Fraud Flies Under the Radar", "style": "analytical_review", "include": ["synthesized_intro", "detailed_analysis_with_quotes", "key_takeaways", "source_links_list"] } }, indent=2) }
-    return prompts
+# The default prompts are shared with the headless pipeline (digest_pipeline.py).
+get_default_prompts = dl.get_default_prompts
 
 def initialize_workflow():
-    """Resets the workflow in the user's session."""
-    session['workflow'] = { "step": 1, "prompts": get_default_prompts(), "results": {} }
-    session.modified = True
+    """Starts a fresh workflow in the store and points the user's session at it."""
+    workflow = { "step": 1, "prompts": get_default_prompts() }
+    session.pop('workflow', None) # drop state left by the old cookie-backed sessions
+    session['workflow_id'] = store.create(workflow)
+    return session['workflow_id'], workflow
+
+def load_workflow():
+    """Returns (workflow_id, workflow) for the current session, starting a new workflow if needed."""
+    workflow_id = session.get('workflow_id')
+    workflow = store.load_state(workflow_id) if workflow_id else None
+    if workflow is None:
+        return initialize_workflow()
+    return workflow_id, workflow
 
 @app.route('/')
 def index():
-    """Displays the main workflow page using session data."""
-    if 'workflow' not in session:
-        initialize_workflow()
-    
-    debug_state = json.dumps(session.get('workflow', {}), indent=2, ensure_ascii=False)
-    return render_template('index.html', debug_state=debug_state, **session['workflow'])
+    """Displays the main workflow page using the stored workflow."""
+    workflow_id, workflow = load_workflow()
+    debug_state = json.dumps(dict(workflow, workflow_id=workflow_id, result_keys=store.result_keys(workflow_id),
+                                  timings=store.get_result(workflow_id, 'timings', {})), indent=2, ensure_ascii=False)
+    job = job_runner.current(workflow_id)
+    return render_template('index.html', debug_state=debug_state, results=LazyResults(store, workflow_id), job=job, job_active=job_runner.is_active(job), **workflow)
 
 @app.route('/update_prompt', methods=['POST'])
 def update_prompt():
-    # ... This function remains the same, but now modifies the session ...
     data = request.get_json()
     step_key, action = data.get('step_key'), data.get('action')
+    workflow_id, _ = load_workflow()
     if action == 'save':
-        session['workflow']['prompts'][step_key] = data.get('prompt_text')
-        session.modified = True
+        update_workflow(workflow_id, prompts={step_key: data.get('prompt_text')})
         return jsonify(success=True, message=f"Prompt for {step_key} saved for this session.")
     elif action == 'reset':
         default_prompts = get_default_prompts()
-        session['workflow']['prompts'][step_key] = default_prompts[step_key]
-        session.modified = True
+        update_workflow(workflow_id, prompts={step_key: default_prompts[step_key]})
         return jsonify(success=True, message=f"Prompt for {step_key} reset.", new_prompt=default_prompts[step_key])
     return jsonify(success=False, message="Invalid action.")
 
 
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    """Progress of the current workflow's background job, polled by the page while a step runs."""
+    workflow_id, _ = load_workflow()
+    job = job_runner.current(workflow_id)
+    if not job or job['id'] != job_id: return jsonify(error="Unknown job."), 404
+    return jsonify(job)
+
+def update_workflow(workflow_id, prompts=None, **changes):
+    """
+    Applies changes to the latest stored workflow state, atomically. Routes and
+    background jobs both save through here, so neither overwrites the other's
+    changes. Does nothing if the workflow was evicted meanwhile.
+    """
+    def apply(workflow):
+        if prompts: workflow['prompts'].update(prompts)
+        workflow.update(changes)
+    store.update_state(workflow_id, apply)
+
+@app.route('/metrics')
+def metrics():
+    """Span timings, HTTP client and fetch cache counters in the Prometheus text format."""
+    lines = [tracer.prometheus().rstrip("\n")]
+    http_stats = dl.HTTP.snapshot()
+    for metric, field in (("requests", "requests"), ("errors", "errors"), ("retries", "retries")):
+        lines.append(f"# TYPE digest_http_{metric}_total counter")
+        lines += [format_sample(f"digest_http_{metric}_total", stats[field], endpoint=endpoint) for endpoint, stats in sorted(http_stats.items())]
+    lines.append("# TYPE digest_http_latency_seconds_sum counter")
+    lines += [format_sample("digest_http_latency_seconds_sum", stats['latency_sum'], endpoint=endpoint) for endpoint, stats in sorted(http_stats.items())]
+    if dl.FETCH_CACHE:
+        cache_stats = dl.FETCH_CACHE.snapshot()
+        lines.append("# TYPE digest_fetch_cache_entries gauge")
+        lines.append(format_sample("digest_fetch_cache_entries", cache_stats.pop('entries')))
+        lines.append("# TYPE digest_fetch_cache_bytes gauge")
+        lines.append(format_sample("digest_fetch_cache_bytes", cache_stats.pop('bytes')))
+        lines.append("# TYPE digest_fetch_cache_events_total counter")
+        lines += [format_sample("digest_fetch_cache_events_total", value, event=event) for event, value in sorted(cache_stats.items())]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+def save_timings(workflow_id, step, spans, started):
+    """Stores a per-step timing summary for the debug panel."""
+    timing = {'total_ms': round((time.perf_counter() - started) * 1000, 1), 'spans': tracing.summarize(spans)}
+    store.update_result(workflow_id, 'timings', lambda timings: dict(timings, **{step: timing}), default={})
+
+def traced_step(job, step, fn, workflow_id, *args):
+    """Runs a step job while collecting its spans into the workflow's timing summary."""
+    started = time.perf_counter()
+    with tracing.trace() as spans:
+        try:
+            fn(job, workflow_id, *args)
+        finally:
+            save_timings(workflow_id, step, spans, started)
+
+def submit_step(workflow_id, prompts, step, fn, *args):
+    """
+    Queues the step as a background job and returns to the page, which polls
+    its status. The user's prompt edits are saved only once the job is
+    accepted, so a rejected submit leaves the running step's state alone.
+    """
+    if job_runner.submit(workflow_id, step, traced_step, step, fn, *args) is None:
+        update_workflow(workflow_id, message=STEP_BUSY_MESSAGE, message_type="error")
+    else:
+        update_workflow(workflow_id, prompts=prompts)
+    return redirect(url_for('index'))
+
 @app.route('/run_step1', methods=['POST'])
 def run_step1():
     """Executes Step 1, now respecting the edited prompt."""
+    workflow_id, workflow = load_workflow()
     prompt_str = request.form.get('prompt_step1')
     try:
         prompt_json = json.loads(prompt_str)
-        session['workflow']['prompts']['step1'] = prompt_str # Save user's edits
     except json.JSONDecodeError:
         return redirect(url_for('index'))
 
     # FIXED: Actually use the parameters from the edited prompt
     query = prompt_json.get("query", "cybercrime news")
     params = prompt_json.get("parameters", {})
-    num_to_fetch = params.get("num_articles", 10) # <-- USING THE EDITED VALUE
+    num_to_fetch = read_num_articles(params) # <-- USING THE EDITED VALUE
+    prioritize, avoid = dedup.selection_criteria(workflow['prompts'].get('step2'))
+    return submit_step(workflow_id, {'step1': prompt_str}, "Step 1", step1_job, workflow_id, query, num_to_fetch, prioritize, avoid)
+
+def read_num_articles(params, default=10):
+    """The step 1 prompt's num_articles, or `default` when it is missing or not a positive integer."""
+    value = params.get("num_articles") if isinstance(params, dict) else None
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 0: return default
+    return value
+
+def step1_job(job, workflow_id, query, num_to_fetch, prioritize=(), avoid=()):
+    # Pages arrive in parallel; each one is reported as it lands, and the final list keeps search rank order.
+    total_pages = dl.search_page_count(num_to_fetch)
+    job.progress(0, total_pages + 1, f"Searching for {num_to_fetch} articles...")
+    pages = {}
+    with tracer.span('search', num=num_to_fetch) as span:
+        for start, page in dl.iter_search_pages(query, num_to_fetch, dedupe=False):
+            pages[start] = page
+            job.progress(len(pages), event=f"Search page {len(pages)}/{total_pages}: {len(page)} results from #{start}.")
+        found_articles = dl.merge_search_pages(pages, num_to_fetch)
+        span['results'] = len(found_articles)
 
-    # Pass the number of articles to the search function
-    found_articles = dl.search_articles(query, num_to_fetch)
-    
     if not found_articles:
-        session['workflow']['message'] = f"Step 1 Failed: Could not find any articles for '{query}'."
-        session['workflow']['message_type'] = "error"
-        return redirect(url_for('index'))
+        update_workflow(workflow_id, message=f"Step 1 Failed: Could not find any articles for '{query}'.", message_type="error")
+        return
 
-    session['workflow']['step'] = 2
-    session['workflow']['results'] = { 'step1': found_articles }
-    session['workflow']['message'] = f"Step 1 Completed: Found {len(found_articles)} articles."
-    session['workflow']['message_type'] = "success"
-    session.modified = True
-    return redirect(url_for('index'))
+    # Near-duplicates and already covered stories go to the end of the list, best candidates first.
+    found_articles = dedup.rank_candidates(found_articles, prioritize, avoid, history=covered_stories)
+    duplicate_count = sum('duplicate_of' in article for article in found_articles)
+    covered_count = sum('covered' in article for article in found_articles)
+    store.clear_results(workflow_id, keep=(JOB_RESULT_KEY,))
+    store.set_result(workflow_id, 'step1', found_articles)
+    job.progress(total_pages + 1, event=f"Found {len(found_articles)} articles.")
+    update_workflow(workflow_id, step=2, message=f"Step 1 Completed: Found {len(found_articles)} articles "
+                                                 f"({duplicate_count} near-duplicates, {covered_count} already covered).", message_type="success")
 
 @app.route('/run_step2', methods=['POST'])
 def run_step2():
-    # ... This function is mostly the same, just using sessions ...
-    session['workflow']['prompts']['step2'] = request.form.get('prompt_step2')
+    workflow_id, _ = load_workflow()
     selected_indices_str = request.form.getlist('selected_articles_indices')
     if len(selected_indices_str) != 5: return redirect(url_for('index'))
 
-    all_articles = session['workflow']['results']['step1']
+    all_articles = store.get_result(workflow_id, 'step1')
+    if not all_articles: return redirect(url_for('index'))
+    prompt_step2 = request.form.get('prompt_step2')
     selected_articles = [all_articles[int(i)] for i in selected_indices_str]
-    session['workflow']['results']['step2'] = selected_articles
-    
-    scraped_articles_data, scrape_error_count = [], 0
-    for article in selected_articles:
-        scrape_result = dl.get_article_content(article['url'])
-        scraped_articles_data.append({'title': article['title'], 'url': article['url'], 'scrape_status': scrape_result['status'], 'content': scrape_result['content']})
-        if scrape_result['status'] == 'error': scrape_error_count += 1
-        
-    prompt_step3_template = json.loads(get_default_prompts()['step3'])
-    prompt_step3_template['articles_data'] = scraped_articles_data
-    session['workflow']['prompts']['step3'] = json.dumps(prompt_step3_template, indent=2)
-    session['workflow']['step'] = 3
-    session['workflow']['message'] = f"Step 2 Completed. Scraped 5 articles with {scrape_error_count} errors."
-    session['workflow']['message_type'] = "success" if scrape_error_count == 0 else "error"
-    session.modified = True
-    return redirect(url_for('index'))
+    return submit_step(workflow_id, {'step2': prompt_step2}, "Step 2", step2_job, workflow_id, selected_articles, read_token_budget(prompt_step2))
+
+def read_token_budget(prompt_str):
+    """
+    The step 2 prompt's token_budget as {'per_article', 'total'}, or None for
+    the default budget when it is missing or not made of positive integers.
+    """
+    try:
+        budget = json.loads(prompt_str).get('token_budget')
+    except (TypeError, AttributeError, json.JSONDecodeError):
+        return None
+    if not isinstance(budget, dict): return None
+    values = {key: budget[key] for key in ('per_article', 'total') if budget.get(key) is not None}
+    if not all(isinstance(value, int) and not isinstance(value, bool) and value > 0 for value in values.values()): return None
+    return values or None
+
+def step2_job(job, workflow_id, selected_articles, token_budget=None):
+    store.set_result(workflow_id, 'step2', selected_articles) # saved by the job, so only an accepted submit replaces the selection
+    job.progress(0, len(selected_articles), f"Scraping {len(selected_articles)} articles...")
+    finished = []
+    def on_result(index, scrape_result):
+        finished.append(index)
+        job.progress(len(finished), event=f"{scrape_result['status']}: {selected_articles[index]['url']}")
+
+    dl.prefetch_digest_images(selected_articles) # resolved in the background while the articles are scraped
+    scrape_results = dl.get_articles_content([article['url'] for article in selected_articles], on_result=on_result)
+    prompt_step3, scrape_error_count, compaction = dl.build_step3_prompt(selected_articles, scrape_results, token_budget)
+    store.set_result(workflow_id, 'step2_compaction', compaction)
+    update_workflow(workflow_id, prompts={'step3': prompt_step3}, step=3,
+                    message=f"Step 2 Completed. Scraped 5 articles with {scrape_error_count} errors. "
+                            f"Article text compacted from ~{compaction['original_tokens']} to ~{compaction['compacted_tokens']} tokens.",
+                    message_type="success" if scrape_error_count == 0 else "error")
 
 @app.route('/run_step3', methods=['POST'])
 def run_step3():
-    # ... This function is mostly the same, just using sessions ...
+    workflow_id, _ = load_workflow()
     user_edited_prompt_str = request.form.get('prompt_step3')
-    session['workflow']['prompts']['step3'] = user_edited_prompt_str
-    ai_result = dl.simulate_ai_digest_generation(user_edited_prompt_str)
+    return submit_step(workflow_id, {'step3': user_edited_prompt_str}, "Step 3", step3_job, workflow_id, user_edited_prompt_str)
+
+def step3_job(job, workflow_id, prompt_str):
+    job.progress(0, 1, "Generating the analytical note...")
+    ai_result = dl.simulate_ai_digest_generation(prompt_str)
+    job.progress(1, 1)
     if ai_result['status'] == 'success':
-        session['workflow']['results']['step4_markdown'] = ai_result['markdown_digest']
-        session['workflow']['step'] = 4
-        session['workflow']['message'], session['workflow']['message_type'] = "Step 3 Completed: Analytical Note simulated.", "success"
+        store.set_result(workflow_id, 'step4_markdown', ai_result['markdown_digest'])
+        update_workflow(workflow_id, step=4, message="Step 3 Completed: Analytical Note simulated.", message_type="success")
     else:
-        session['workflow']['message'], session['workflow']['message_type'] = f"Step 3 Failed: {ai_result['markdown_digest']}", "error"
-    session.modified = True
-    return redirect(url_for('index'))
+        update_workflow(workflow_id, message=f"Step 3 Failed: {ai_result['markdown_digest']}", message_type="error")
 
 @app.route('/run_step4', methods=['POST'])
 def run_step4():
-    # ... This function is mostly the same, just using sessions ...
-    final_markdown = request.form.get('final_markdown_digest')
-    session['workflow']['results']['step4_markdown'] = final_markdown
-    tilda_html = dl.convert_markdown_to_tilda_html(final_markdown)
-    session['workflow']['results']['step4_tilda_html'] = tilda_html
-    session['workflow']['message'], session['workflow']['message_type'] = "Step 4 Completed: Tilda HTML generated.", "success"
-    session.modified = True
+    workflow_id, _ = load_workflow()
+    if job_runner.is_active(job_runner.current(workflow_id)):
+        update_workflow(workflow_id, message=STEP_BUSY_MESSAGE, message_type="error")
+        return redirect(url_for('index'))
+    started = time.perf_counter()
+    with tracing.trace() as spans:
+        final_markdown = request.form.get('final_markdown_digest')
+        store.set_result(workflow_id, 'step4_markdown', final_markdown)
+        tilda_html = dl.convert_markdown_to_tilda_html(final_markdown)
+        store.set_result(workflow_id, 'step4_tilda_html', tilda_html)
+        update_workflow(workflow_id, message="Step 4 Completed: Tilda HTML generated.", message_type="success")
+        # Only a finished digest counts as coverage; re-running step 4 just refreshes the same stories.
+        if covered_stories: covered_stories.record(store.get_result(workflow_id, 'step2') or [])
+    save_timings(workflow_id, "Step 4", spans, started)
     return redirect(url_for('index'))
 
 if __name__ == '__main__':
@@ -0,0 +1,315 @@
+# benchmarks/bench_pipeline.py
+#
+# Offline benchmark and load test of the digest pipeline. The Custom Search API,
+# the article sites and Gemini are replaced by the local fakes in fakes.py, so
+# runs are repeatable and cost nothing. Measures:
+#   - per-step latency (search, dedup, scrape, step 3 prompt, generation, Tilda HTML), cold and warm cache
+#   - Flask route latency and workflows/sec with concurrent sessions
+#   - peak memory (tracemalloc) of scraping and of the Tilda HTML conversion
+#   - the __main.py report generation with a stubbed Gemini, uncached and cached
+# Results are written as JSON; --compare flags regressions against an earlier run.
+#
+#   python benchmarks/bench_pipeline.py --latency-ms 80 --sessions 8
+#   python benchmarks/bench_pipeline.py --compare benchmarks/results/abc1234.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from fakes import FakeWebServer, install_fake_genai
+# Project modules read their configuration on import, so they are imported inside the
+# bench_* functions, after configure_environment().
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+QUERY = "latest digital fraud and cybercrime news"
+DEFAULT_THRESHOLD = 0.25 # relative change that counts as a regression; timings on a shared machine are noisy
+MIN_DELTA = {'_ms': 5.0, '_bytes': 256 * 1024} # smaller absolute changes are never regressions, whatever their ratio
+
+
+def log(message):
+    # The pipeline prints progress to stdout, which is silenced while measuring.
+    print(message, file=sys.__stdout__, flush=True)
+
+
+class QueryScopedServer(FakeWebServer):
+    """Links carry a per-query parameter, so concurrent sessions with different queries do not share cached pages."""
+
+    def search(self, query, start, num, image=False):
+        payload = super().search(query, start, num, image)
+        for item in payload.get('items', []):
+            if not image: item['link'] += f"?s={zlib.crc32(query.encode('utf-8'))}"
+        return payload
+
+
+def configure_environment(server, workdir, args):
+    """Points digest_logic, app and __main at the fakes. Must run before they are imported."""
+    os.environ.update({
+        'CUSTOM_SEARCH_URL': server.search_url, 'GOOGLE_API_KEY': "offline", 'SEARCH_ENGINE_ID': "offline",
+        'FETCH_CACHE_PATH': os.path.join(workdir, "fetch_cache.sqlite3"),
+        'RESPONSE_CACHE_PATH': os.path.join(workdir, "response_cache.sqlite3"),
+        'WORKFLOW_STORE': "memory", 'DEDUP_HISTORY_ENABLED': "0",
+        # All fake articles live on 127.0.0.1; lift the per-host cap so scraping behaves as with distinct sites.
+        'SCRAPE_PER_HOST_LIMIT': str(args.per_host_limit), 'JOB_WORKERS': str(args.job_workers),
+    })
+
+
+def reset_caches(dl):
+    if dl.FETCH_CACHE: dl.FETCH_CACHE.clear()
+    with dl._image_lookups_lock: dl._image_lookups.clear()
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+# --- Measurements ---
+
+def bench_steps(args):
+    """Median per-step latency over args.repeat runs of the headless flow, with a cold and a warm fetch cache."""
+    import dedup
+    import digest_logic as dl
+    import digest_pipeline
+    import tracing
+
+    prioritize, avoid = dedup.selection_criteria(dl.get_default_prompts()['step2'])
+    metrics, details = {}, {}
+    for label in ("cold", "warm"):
+        samples = {}
+        def step(name, fn, *fn_args):
+            result, ms = timed(fn, *fn_args)
+            samples.setdefault(name, []).append(ms)
+            return result
+
+        for _ in range(args.repeat):
+            if label == "cold": reset_caches(dl)
+            with tracing.trace() as spans:
+                candidates = step('search_ms', dl.search_articles, QUERY, args.candidates)
+                if not candidates: raise RuntimeError("the fake search returned no results")
+                ranked = step('dedup_ms', dedup.rank_candidates, candidates, prioritize, avoid)
+                selected = digest_pipeline.select_articles(ranked, 5)
+                dl.prefetch_digest_images(selected)
+                scraped = step('scrape_ms', dl.get_articles_content, [article['url'] for article in selected])
+                prompt, _, _ = step('step3_prompt_ms', dl.build_step3_prompt, selected, scraped)
+                ai_result = step('generate_ms', dl.simulate_ai_digest_generation, prompt)
+                step('tilda_html_ms', dl.convert_markdown_to_tilda_html, ai_result['markdown_digest'])
+            details[f"steps.{label}.spans"] = tracing.summarize(spans) # of the last run
+        for name, values in samples.items():
+            metrics[f"steps.{label}.{name}"] = round(median(values), 2)
+        metrics[f"steps.{label}.total_ms"] = round(sum(metrics[f"steps.{label}.{name}"] for name in samples), 2)
+    return metrics, details
+
+
+def bench_flask(args):
+    """Runs args.rounds full workflows (steps 1-4, polling /status like the page does) in each of args.sessions sessions at once."""
+    import app as web
+    from jobs import ACTIVE_STATES
+
+    latencies, errors, lock = {}, [], threading.Lock()
+
+    def call(route, fn, *fn_args, **fn_kwargs):
+        response, ms = timed(fn, *fn_args, **fn_kwargs)
+        with lock:
+            latencies.setdefault(route, []).append(ms)
+            if response.status_code >= 400 and route != "GET /status": errors.append(f"{route}: {response.status_code}")
+        return response
+
+    def wait_for_job(client):
+        with client.session_transaction() as session: workflow_id = session['workflow_id']
+        job = web.job_runner.current(workflow_id)
+        while True:
+            status = call("GET /status", client.get, f"/status/{job['id']}").get_json()
+            if status['state'] not in ACTIVE_STATES:
+                if status['state'] != 'done': errors.append(f"{job['step']}: {status['message']}")
+                return workflow_id
+            time.sleep(args.poll_interval)
+
+    def session_worker(session_index):
+        client = web.app.test_client()
+        for round_index in range(args.rounds):
+            step1 = json.loads(web.get_default_prompts()['step1'])
+            step1['query'] = f"{QUERY} {session_index}-{round_index}" # distinct queries, so the fetch cache does not hide the load
+            step1['parameters']['num_articles'] = args.candidates
+            call("GET /", client.get, "/")
+            call("POST /run_step1", client.post, "/run_step1", data={'prompt_step1': json.dumps(step1)})
+            wait_for_job(client)
+            call("POST /run_step2", client.post, "/run_step2",
+                 data={'prompt_step2': web.get_default_prompts()['step2'], 'selected_articles_indices': ['0', '1', '2', '3', '4']})
+            workflow_id = wait_for_job(client)
+            call("POST /run_step3", client.post, "/run_step3", data={'prompt_step3': web.store.load_state(workflow_id)['prompts']['step3']})
+            wait_for_job(client)
+            call("POST /run_step4", client.post, "/run_step4", data={'final_markdown_digest': web.store.get_result(workflow_id, 'step4_markdown') or ''})
+            call("GET /", client.get, "/")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        list(executor.map(session_worker, range(args.sessions)))
+    elapsed = time.perf_counter() - started
+
+    workflows = args.sessions * args.rounds
+    metrics = {'flask.workflows_per_sec': round(workflows / elapsed, 3), 'flask.elapsed_ms': round(elapsed * 1000, 1),
+               'flask.errors': len(errors)}
+    for route, values in sorted(latencies.items()):
+        key = route.split()[1].strip("/") or "index"
+        metrics[f"flask.{key}.p50_ms"] = round(percentile(values, 0.5), 2)
+        metrics[f"flask.{key}.p95_ms"] = round(percentile(values, 0.95), 2)
+    return metrics, {'flask.errors': errors[:20], 'flask.requests': {route: len(values) for route, values in latencies.items()}}
+
+
+def bench_memory(args):
+    """Peak traced allocations while scraping args.memory_pages pages (cold cache) and converting a large digest."""
+    import digest_logic as dl
+    from bench_tilda import synthetic_digest
+
+    reset_caches(dl)
+    urls = [f"{os.environ['CUSTOM_SEARCH_URL'].rsplit('/customsearch', 1)[0]}/articles/{i}.html" for i in range(1, args.memory_pages + 1)]
+    tracemalloc.start()
+    dl.get_articles_content(urls, deadline=60)
+    _, scrape_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    markdown_text = synthetic_digest(args.digest_articles)
+    tracemalloc.start()
+    dl.convert_markdown_to_tilda_html(markdown_text)
+    _, tilda_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'memory.scrape_peak_bytes': scrape_peak, 'memory.tilda_html_peak_bytes': tilda_peak}, {}
+
+
+def bench_gemini(args, workdir):
+    """__main.py report generation against the stubbed Gemini: streamed, blocking, and served from the response cache."""
+    install_fake_genai(first_token_delay=args.gemini_first_token_ms / 1000, chunk_delay=args.gemini_chunk_ms / 1000)
+    import importlib
+    report = importlib.import_module("__main")
+    report.OUTPUT_FILE = os.path.join(workdir, "report.md")
+    cache = report.make_response_cache()
+
+    metrics = {}
+    for label, stream in (("stream", True), ("blocking", False)):
+        cache.clear()
+        ok, metrics[f"gemini.{label}_ms"] = timed(report.generate_report, report.BASE_REQUEST, report.OUTPUT_FILE, cache, stream=stream)
+        assert ok, f"{label} generation failed"
+    _, metrics["gemini.cached_ms"] = timed(report.generate_report, report.BASE_REQUEST, report.OUTPUT_FILE, cache)
+    return {name: round(value, 2) for name, value in metrics.items()}, {}
+
+
+# --- Results ---
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR, capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current, previous, threshold):
+    """Metrics that got worse by more than `threshold` (relative): [(name, before, after, change)]."""
+    regressions = []
+    for name, after in current.items():
+        before = previous.get(name)
+        if not isinstance(before, (int, float)): continue
+        if name == "flask.errors":
+            if after > before: regressions.append((name, before, after, (after - before) / max(before, 1)))
+            continue
+        if not before or not name.endswith(("_ms", "_bytes", "_per_sec")): continue
+        change = (before - after if name.endswith("_per_sec") else after - before) / before # positive is worse
+        if any(name.endswith(suffix) and after - before < delta for suffix, delta in MIN_DELTA.items()): continue
+        if change > threshold: regressions.append((name, before, after, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark and load test of the digest pipeline.")
+    parser.add_argument("--latency-ms", type=float, default=50, help="latency of every fake search/article response (default: 50)")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="random extra latency, up to this much (default: 20)")
+    parser.add_argument("--paragraphs", type=int, default=30, help="paragraphs per generated article page (default: 30)")
+    parser.add_argument("--candidates", type=int, default=20, help="search results per query (default: 20)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per step measurement; the median is reported (default: 3)")
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent Flask sessions (default: 8)")
+    parser.add_argument("--rounds", type=int, default=2, help="workflows per session (default: 2)")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="seconds between /status polls (default: 0.05)")
+    parser.add_argument("--job-workers", type=int, default=4, help="JOB_WORKERS for the app (default: 4)")
+    parser.add_argument("--per-host-limit", type=int, default=8, help="SCRAPE_PER_HOST_LIMIT (default: 8, since every fake site is one host)")
+    parser.add_argument("--memory-pages", type=int, default=20, help="pages scraped for the memory measurement (default: 20)")
+    parser.add_argument("--digest-articles", type=int, default=200, help="articles in the synthetic digest for the memory measurement (default: 200)")
+    parser.add_argument("--gemini-first-token-ms", type=float, default=300, help="stubbed Gemini time to first token (default: 300)")
+    parser.add_argument("--gemini-chunk-ms", type=float, default=20, help="stubbed Gemini delay between streamed chunks (default: 20)")
+    parser.add_argument("--skip", action="append", default=[], choices=["steps", "flask", "memory", "gemini"], help="leave out a measurement")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<git revision>.json)")
+    parser.add_argument("--compare", help="earlier results file; regressions make the exit status 1")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help=f"relative change counted as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    revision = git_revision()
+    server = QueryScopedServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, paragraphs=args.paragraphs).start()
+    workdir = tempfile.mkdtemp(prefix="digest-bench-")
+    configure_environment(server, workdir, args)
+    log(f"🧪 Benchmarking {revision} against fakes at {server.base_url} (corpus: {len(server.corpus) or 'generated'} pages)")
+
+    metrics, details = {}, {}
+    benches = [("steps", bench_steps, ()), ("flask", bench_flask, ()), ("memory", bench_memory, ()), ("gemini", bench_gemini, (workdir,))]
+    try:
+        for name, bench, extra in benches:
+            if name in args.skip: continue
+            log(f"⏱️ {name}...")
+            with contextlib.redirect_stdout(io.StringIO()):
+                bench_metrics, bench_details = bench(args, *extra)
+            metrics.update(bench_metrics)
+            details.update(bench_details)
+    finally:
+        server.stop()
+
+    results = {'meta': {'revision': revision, 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'python': platform.python_version(),
+                        'platform': platform.platform(), 'options': vars(args), 'fake_requests': server.requests},
+               'metrics': metrics, 'details': details}
+    output = args.output or os.path.join(RESULTS_DIR, f"{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    for name, value in metrics.items():
+        log(f"   {name:<40} {value}")
+    log(f"📄 Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        regressions = compare(metrics, previous['metrics'], args.threshold)
+        for name, before, after, change in regressions:
+            log(f"❌ {name}: {before} -> {after} ({change:+.0%} worse)")
+        if regressions: return 1
+        log(f"✅ No regressions against {previous['meta']['revision']} (threshold {args.threshold:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
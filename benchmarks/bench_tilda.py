@@ -0,0 +1,100 @@
+# benchmarks/bench_tilda.py
+#
+# Benchmarks convert_markdown_to_tilda_html on a large synthetic digest and
+# checks that it produces exactly the same HTML as the original implementation
+# (whole-document markdown2 plus one find_all pass per style rule).
+#
+#   python benchmarks/bench_tilda.py --articles 200 --repeat 5
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+from bs4 import BeautifulSoup
+import digest_logic as dl
+
+
+def legacy_convert_markdown_to_tilda_html(markdown_text):
+    """The original implementation: one find_all pass per rule."""
+    html = markdown2.markdown(markdown_text, extras=["smarty-pants"])
+    soup = BeautifulSoup(html, 'html.parser')
+    FONT_FAMILY = "'-apple-system', 'BlinkMacSystemFont', 'Segoe UI', 'Roboto', 'Helvetica', 'Arial', sans-serif"
+    for tag in soup.find_all(['h1', 'h3', 'p', 'a', 'em', 'strong', 'li']): tag['style'] = f"font-family: {FONT_FAMILY};"
+    for h1 in soup.find_all('h1'): h1['style'] += "font-size: 42px; font-weight: 700; color: #111; line-height: 1.2;"
+    for h3 in soup.find_all('h3'): h3['style'] += "font-size: 24px; font-weight: 600; color: #111; line-height: 1.3;"
+    for p in soup.find_all('p'): p['style'] += "font-size: 18px; color: #333; line-height: 1.6;"
+    for img in soup.find_all('img'): img['style'] = "max-width: 100%; height: auto; border-radius: 8px; margin-bottom: 20px;"
+    for blockquote in soup.find_all('blockquote'):
+        blockquote['style'] = "border-left: 3px solid #333; padding-left: 25px; margin: 20px 0;"
+        if p_tag := blockquote.find('p'): p_tag['style'] = f"font-family: {FONT_FAMILY}; font-size: 22px; font-style: italic; color: #111;"
+    for a in soup.find_all('a'):
+        a['target'] = '_blank'
+        a['style'] += "color: #007bff; text-decoration: none;"
+    return soup.prettify()
+
+
+def synthetic_digest(num_articles):
+    """A digest shaped like simulate_ai_digest_generation output, plus every Markdown construct the styler touches."""
+    md = "# Beyond the Breach: Why Digital Fraud Flies Under the Radar\n\n"
+    md += "![Main illustration](https://example.com/main.png)\n\n"
+    md += "The news is full of headlines about *major* cyberattacks... But **another** threat operates quietly.\n\n"
+    for i in range(num_articles):
+        md += f"### Article {i}: \"Scammers\" target payment rails\n\n"
+        md += f"![Illustration {i}](https://example.com/img{i}.png \"Figure {i}\")\n\n"
+        for j in range(4):
+            md += f"Paragraph {j} of article {i} describes the [incident](https://example.com/{i}/{j}) in detail -- with *emphasis*, **strong text** and figures like $1.2M.\n\n"
+        md += f"> A pull quote for article {i} that summarises the impact.\n>\n> A second quoted paragraph.\n\n"
+        md += "#### Рекомендации по предотвращению\n\n"
+        md += "* Enable **multi-factor** authentication.\n* Verify payment *changes* out of band.\n* Train staff on [phishing](https://example.com/phish).\n\n"
+    md += "---\n\n### Source Articles\n\n"
+    md += "".join(f"* [Article {i}](https://example.com/{i})\n" for i in range(num_articles))
+    return md
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles", type=int, default=200, help="articles in the synthetic digest")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per variant; the best time is reported")
+    args = parser.parse_args(argv)
+
+    md = synthetic_digest(args.articles)
+    print(f"📏 Synthetic digest: {args.articles} articles, {len(md) / 1024:.0f} KB of Markdown")
+
+    legacy_time, legacy_html = best_of(lambda: legacy_convert_markdown_to_tilda_html(md), args.repeat)
+    new_time, new_html = best_of(lambda: dl.convert_markdown_to_tilda_html(md, parser='html.parser'), args.repeat)
+    minified_time, _ = best_of(lambda: dl.convert_markdown_to_tilda_html(md, parser='html.parser', minify=True), args.repeat)
+    markdown_time, _ = best_of(lambda: markdown2.markdown(md, extras=["smarty-pants"]), args.repeat)
+    sections_time, _ = best_of(lambda: dl._markdown_to_html(md), args.repeat)
+
+    if new_html != legacy_html:
+        print("❌ Output differs from the legacy implementation")
+        return 1
+    print("✅ Output is identical to the legacy implementation")
+    print(f"   markdown2, whole:         {markdown_time * 1000:8.1f} ms")
+    print(f"   markdown2, by section:    {sections_time * 1000:8.1f} ms ({markdown_time / sections_time:.2f}x)")
+    print(f"   legacy (multi-pass):      {legacy_time * 1000:8.1f} ms")
+    print(f"   current + prettify:       {new_time * 1000:8.1f} ms ({legacy_time / new_time:.2f}x)")
+    print(f"   current + minify:         {minified_time * 1000:8.1f} ms ({legacy_time / minified_time:.2f}x)")
+    try:
+        lxml_time, _ = best_of(lambda: dl.convert_markdown_to_tilda_html(md, parser='lxml', minify=True), args.repeat)
+        print(f"   current, lxml + minify:   {lxml_time * 1000:8.1f} ms ({legacy_time / lxml_time:.2f}x)")
+    except Exception as e: # bs4 raises FeatureNotFound when lxml is not installed
+        print(f"   lxml parser skipped: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
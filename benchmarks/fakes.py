@@ -0,0 +1,189 @@
+# benchmarks/fakes.py
+#
+# Offline stand-ins for everything the digest pipeline talks to:
+#   - FakeWebServer: a local Custom Search API plus the article pages it links to,
+#     served from benchmarks/corpus/*.html when present (saved pages), otherwise
+#     from generated news-site-like pages, with configurable latency.
+#   - install_fake_genai(): a stubbed google.generativeai that streams a canned report.
+#
+# Nothing here touches the network beyond 127.0.0.1.
+
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+WORDS = """fraud scam phishing ransomware bank payment crypto exchange wallet breach attackers police arrested
+customers accounts million losses investigation malware campaign credentials stolen data hospital retailer
+regulators fine victims invoice transfer network criminals operators infrastructure law enforcement europol
+company said statement researchers discovered vulnerability exploit patch users emails messages phone
+""".split()
+
+
+def _sentence(rng, words=18):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text.capitalize() + f" {rng.randrange(2, 900)} {rng.choice(['million', 'accounts', 'victims', 'days'])}."
+
+
+def make_article_page(index, paragraphs=30, seed=0):
+    """A generated article page with the usual furniture (scripts, nav, cookie banner, related links, footer)."""
+    rng = random.Random(seed * 100003 + index)
+    title = f"Story {index}: " + " ".join(rng.choice(WORDS) for _ in range(7))
+    body = "".join(f"<p>{' '.join(_sentence(rng) for _ in range(rng.randrange(2, 5)))}</p>\n" for _ in range(paragraphs))
+    nav = "".join(f"<li><a href='/section/{i}'>Section {i}</a></li>" for i in range(40))
+    related = "".join(f"<li><a href='/articles/{index + i}.html'>Related story {index + i}</a></li>" for i in range(1, 15))
+    script = "<script>" + "var tracker = {};" * 400 + "</script>"
+    return f"""<!DOCTYPE html><html><head><title>{title}</title>{script}<style>{'.c{{color:red}}' * 300}</style></head>
+<body><header><nav><ul>{nav}</ul></nav></header>
+<div class="cookie-banner"><p>We use cookies to improve your experience. Accept all cookies?</p></div>
+<main><article><h1>{title}</h1><p class="byline">By Staff Reporter</p>
+{body}</article>
+<aside><h3>Related articles</h3><ul>{related}</ul></aside></main>
+<footer><p>© 2024 Example News. All rights reserved.</p><form><input name="email"><button>Subscribe</button></form></footer>
+{script}</body></html>"""
+
+
+class FakeWebServer:
+    """
+    Serves /customsearch/v1 (web and image search) and /articles/<n>.html on
+    127.0.0.1. Every request waits `latency` seconds plus up to `jitter`.
+    Every `duplicate_every`-th search result repeats the previous story's title
+    and snippet under another URL, like a syndicated copy.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, paragraphs=30, duplicate_every=5, seed=0):
+        self.latency, self.jitter, self.paragraphs = latency, jitter, paragraphs
+        self.duplicate_every, self.seed = duplicate_every, seed
+        self.corpus = [open(path, encoding="utf-8").read() for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*.html")))]
+        self.requests = 0
+        self._pages, self._lock = {}, threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.search_url = f"{self.base_url}/customsearch/v1"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="fake-web").start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def page(self, index):
+        if self.corpus: return self.corpus[index % len(self.corpus)]
+        with self._lock:
+            if index not in self._pages: self._pages[index] = make_article_page(index, self.paragraphs, self.seed)
+            return self._pages[index]
+
+    def search(self, query, start, num, image=False):
+        if image:
+            return {'items': [{'link': f"{self.base_url}/images/{abs(hash(query)) % 1000}.png"}]}
+        rng = random.Random(f"{self.seed}:{query}")
+        stories = [(f"Story {i}: " + " ".join(rng.choice(WORDS) for _ in range(7)), _sentence(rng, 25)) for i in range(start + num)]
+        items = []
+        for position in range(start, start + num):
+            story = position - 1 if self.duplicate_every and position % self.duplicate_every == 0 else position
+            title, snippet = stories[story - 1]
+            items.append({'title': title, 'link': f"{self.base_url}/articles/{position}.html", 'snippet': snippet})
+        return {'searchInformation': {'totalResults': "100"}, 'items': items}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock: server.requests += 1
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+                url = urlsplit(self.path)
+                if url.path == "/customsearch/v1":
+                    params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                    payload = server.search(params.get('q', ''), int(params.get('start', 1)), int(params.get('num', 10)), params.get('searchType') == 'image')
+                    return self._send(200, json.dumps(payload).encode('utf-8'), "application/json")
+                if url.path.startswith("/articles/"):
+                    index = int(url.path.rsplit("/", 1)[-1].split(".")[0])
+                    return self._send(200, server.page(index).encode('utf-8'), "text/html; charset=utf-8")
+                self._send(404, b"not found", "text/plain")
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# --- Stubbed Gemini ---
+FAKE_REPORT = "## Еженедельный Обзор Цифровых Угроз\n\n" + "".join(
+    f"### Подробный разбор: статья {i}\n\n" + "Текст разбора с анализом угрозы и последствий. " * 40 + "\n\n" for i in range(1, 6))
+
+
+def install_fake_genai(first_token_delay=0.3, chunk_delay=0.02, chunk_chars=200):
+    """
+    Puts a stub google.generativeai in sys.modules so __main.py runs offline.
+    Responses are FAKE_REPORT, streamed in `chunk_chars` pieces. Context
+    caching reports itself as unavailable. Returns the stub module; its
+    `calls` list records every request.
+    """
+    genai = types.ModuleType("google.generativeai")
+    genai.calls = []
+
+    class Chunk:
+        def __init__(self, text): self.text = text
+
+    class Response:
+        def __init__(self, stream):
+            self.stream = stream
+            self.usage_metadata = types.SimpleNamespace(candidates_token_count=len(FAKE_REPORT) // 4)
+            if not stream: time.sleep(first_token_delay + chunk_delay * (len(FAKE_REPORT) // chunk_chars))
+
+        @property
+        def text(self): return FAKE_REPORT
+
+        def __iter__(self):
+            time.sleep(first_token_delay)
+            for i in range(0, len(FAKE_REPORT), chunk_chars):
+                if i: time.sleep(chunk_delay)
+                yield Chunk(FAKE_REPORT[i:i + chunk_chars])
+
+    class GenerativeModel:
+        def __init__(self, model_name=None, system_instruction=None):
+            self.model_name, self.system_instruction = model_name, system_instruction
+
+        def generate_content(self, request, stream=False):
+            genai.calls.append(request)
+            return Response(stream)
+
+        @classmethod
+        def from_cached_content(cls, cached_content): raise RuntimeError("context caching is not stubbed")
+
+    class CachedContent:
+        @staticmethod
+        def list(): return []
+
+        @staticmethod
+        def create(**kwargs): raise RuntimeError("context caching is not stubbed")
+
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = GenerativeModel
+    genai.caching = types.SimpleNamespace(CachedContent=CachedContent)
+    try:
+        import google # keep the real namespace package (protobuf etc.) when it is installed
+    except ImportError:
+        google = sys.modules.setdefault("google", types.ModuleType("google"))
+    google.generativeai = genai
+    sys.modules["google.generativeai"] = genai
+    return genai
@@ -0,0 +1,119 @@
+# compaction.py
+
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+
+# --- Configuration ---
+COMPACT_PER_ARTICLE_TOKENS = int(os.getenv("COMPACT_PER_ARTICLE_TOKENS", "800"))
+COMPACT_TOTAL_TOKENS = int(os.getenv("COMPACT_TOTAL_TOKENS", "3500"))
+CHARS_PER_TOKEN = 4 # rough average for English prose; good enough for budgeting
+MIN_PARAGRAPH_WORDS = 6 # shorter lines are captions, bylines and buttons
+DUPLICATE_NOTE = "(Same text as an earlier article in this digest.)"
+
+# Paragraphs that open with one of these phrases (or carry a copyright line) are site
+# furniture. Single words such as "cookies" or "log in" are not enough: in cybercrime
+# stories they are often the news itself.
+BOILERPLATE_RE = re.compile(
+    r"^(we use cookies|this (web)?site uses cookies|accept (all )?cookies|(subscribe|sign up) (to|for) our|"
+    r"advertisement|related (articles|stories)|share (this|on)|follow us|read more)\b|all rights reserved|©", re.IGNORECASE)
+WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+STOPWORDS = frozenset("""
+a about after all also an and are as at be been but by can could for from had has have he her his how if in into is it its
+more most new not of on one or our out over said says she so than that the their them there these they this to up was we
+were what when which who will with would you your
+""".split())
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def compact_articles(articles_data, per_article_tokens=None, total_tokens=None):
+    """
+    Shrinks the scraped articles of the step 3 prompt to a token budget.
+    Boilerplate, very short and duplicate paragraphs (also across articles)
+    are dropped. The most informative of the rest are kept in their original
+    order, scored by how many of the article's frequent terms they contain.
+    Each article gets min(per_article_tokens, total_tokens / articles).
+    Returns (compacted_articles, report); failed scrapes pass through unchanged.
+    """
+    per_article_tokens = per_article_tokens or COMPACT_PER_ARTICLE_TOKENS
+    total_tokens = total_tokens or COMPACT_TOTAL_TOKENS
+    scraped = [article for article in articles_data if article.get('scrape_status') != 'error']
+    budget = min(per_article_tokens, total_tokens // max(1, len(scraped)))
+
+    seen_paragraphs, compacted, report_articles = set(), [], []
+    for article in articles_data:
+        content = article.get('content') or ''
+        if article.get('scrape_status') == 'error':
+            compacted.append(article)
+            continue
+        paragraphs = [p.strip() for p in content.split('\n') if p.strip()]
+        substantive = [p for p in paragraphs if not _is_boilerplate(p)]
+        kept = _select_paragraphs([p for p in substantive if _first_sighting(p, seen_paragraphs)], budget)
+        if kept: compacted_content = "\n".join(kept)
+        elif substantive: compacted_content = DUPLICATE_NOTE # everything was already in an earlier article
+        else: compacted_content = content[:budget * CHARS_PER_TOKEN] # nothing looked like prose; keep the start as-is
+        compacted.append(dict(article, content=compacted_content))
+        report_articles.append({'title': article.get('title'), 'original_tokens': estimate_tokens(content),
+                                'compacted_tokens': estimate_tokens(compacted_content),
+                                'paragraphs_kept': len(kept), 'paragraphs_dropped': len(paragraphs) - len(kept)})
+
+    report = {'budget_per_article': budget,
+              'original_tokens': sum(estimate_tokens(a.get('content') or '') for a in articles_data),
+              'compacted_tokens': sum(estimate_tokens(a.get('content') or '') for a in compacted),
+              'articles': report_articles}
+    return compacted, report
+
+
+def _is_boilerplate(paragraph):
+    return len(paragraph.split()) < MIN_PARAGRAPH_WORDS or bool(BOILERPLATE_RE.search(paragraph))
+
+
+def _first_sighting(paragraph, seen):
+    """True the first time a paragraph (ignoring case, spacing and punctuation) is seen."""
+    digest = hashlib.sha1(" ".join(WORD_RE.findall(paragraph.lower())).encode('utf-8')).digest()
+    if digest in seen: return False
+    seen.add(digest)
+    return True
+
+
+def _select_paragraphs(paragraphs, budget):
+    """
+    Highest-scoring paragraphs that fit in `budget` tokens, in their original
+    order. If none fits, the best one is cut to the budget.
+    """
+    term_counts = Counter(word for p in paragraphs for word in _terms(p))
+    scored = []
+    for position, paragraph in enumerate(paragraphs):
+        terms = set(_terms(paragraph))
+        score = sum(term_counts[term] - 1 for term in terms) / math.sqrt(len(paragraph.split()))
+        score += any(char.isdigit() for char in paragraph) # figures (amounts, dates, counts) carry the news
+        score += 2.0 / (1 + position) # lead paragraphs usually summarize the story
+        scored.append((score, position, paragraph))
+
+    chosen, used = [], 0
+    for score, position, paragraph in sorted(scored, key=lambda item: -item[0]):
+        cost = estimate_tokens(paragraph) + 1
+        if used + cost > budget: continue
+        chosen.append((position, paragraph))
+        used += cost
+    if not chosen and scored:
+        best = max(scored, key=lambda item: item[0])[2]
+        return [_cut(best, budget)]
+    return [paragraph for _, paragraph in sorted(chosen)]
+
+
+def _cut(paragraph, budget):
+    """The start of `paragraph`, ending on a word boundary, within `budget` tokens."""
+    limit = max(1, budget - 1) * CHARS_PER_TOKEN - 1
+    if len(paragraph) <= limit: return paragraph
+    return paragraph[:limit].rsplit(' ', 1)[0] + "…"
+
+
+def _terms(paragraph):
+    return [word for word in WORD_RE.findall(paragraph.lower()) if len(word) > 2 and word not in STOPWORDS]
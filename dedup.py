@@ -0,0 +1,205 @@
+# dedup.py
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from tracing import tracer
+
+# --- Configuration ---
+DEDUP_HISTORY_ENABLED = os.getenv("DEDUP_HISTORY_ENABLED", "1") not in ("0", "false", "no")
+DEDUP_HISTORY_PATH = os.getenv("DEDUP_HISTORY_PATH", "covered_stories.sqlite3")
+DEDUP_HISTORY_DAYS = int(os.getenv("DEDUP_HISTORY_DAYS", "90"))
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.5")) # estimated Jaccard similarity that counts as the same story
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 16 # 16 bands x 4 rows: pairs above ~0.5 similarity almost always share a band
+SHINGLE_SIZE = 2
+_MERSENNE_PRIME = (1 << 61) - 1
+WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+# Words and phrases that suggest a candidate matches a step 2 `prioritize` criterion.
+# Criteria not listed here are matched by their own words. Words found in almost
+# every cybercrime headline ("new", "malware", "campaign") would boost every candidate
+# alike, so "new threats" only counts more specific phrasings.
+PRIORITY_KEYWORDS = {
+    "new threats": ["novel", "emerging", "zero-day", "zero day", "new variant", "new malware", "new strain", "new technique",
+                    "previously unknown", "never-before-seen", "never seen before", "first-of-its-kind"],
+    "major financial impact": ["million", "billion", "$", "€", "£", "losses", "lost", "stolen", "ransom", "fine", "fined", "damages"],
+}
+
+
+class MinHasher:
+    """MinHash signatures over word shingles; the share of equal slots estimates Jaccard similarity."""
+
+    def __init__(self, num_permutations=NUM_PERMUTATIONS, seed=1):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_permutations)]
+
+    def signature(self, text):
+        words = WORD_RE.findall(text.lower())
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles]
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self.permutations)
+
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / len(signature_a)
+
+
+def band_keys(signature, bands=LSH_BANDS):
+    """LSH bucket keys: texts that share any key are near-duplicate candidates."""
+    rows = len(signature) // bands
+    return [f"{band}:" + hashlib.blake2b(repr(signature[band * rows:(band + 1) * rows]).encode(), digest_size=8).hexdigest()
+            for band in range(bands)]
+
+
+class CandidateIndex:
+    """In-memory LSH index, so grouping hundreds of candidates avoids comparing every pair."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.signatures = {}
+
+    def add(self, key, signature):
+        self.signatures[key] = signature
+        for band in band_keys(signature):
+            self.buckets.setdefault(band, []).append(key)
+
+    def similar(self, signature, threshold=DEDUP_THRESHOLD):
+        """Keys of indexed texts at least `threshold` similar to `signature`."""
+        candidates = {key for band in band_keys(signature) for key in self.buckets.get(band, ())}
+        return [key for key in candidates if similarity(signature, self.signatures[key]) >= threshold]
+
+
+class CoveredStories:
+    """
+    Stories used in earlier digests (SQLite), so later runs can push them down.
+    Lookups go through an index of LSH band keys, so the history can grow over
+    many weekly runs without comparing every stored story.
+    """
+
+    def __init__(self, path=DEDUP_HISTORY_PATH, keep_days=DEDUP_HISTORY_DAYS, hasher=None):
+        self.path, self.keep_days = path, keep_days
+        self.hasher = hasher or MinHasher()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS stories (id INTEGER PRIMARY KEY, url TEXT, title TEXT, signature TEXT NOT NULL, covered_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS story_bands (band TEXT NOT NULL, story_id INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS story_bands_band ON story_bands (band)")
+            # Histories written before stories were unique per URL: keep the latest copy of each.
+            conn.execute("DELETE FROM stories WHERE url IS NOT NULL AND id NOT IN (SELECT MAX(id) FROM stories GROUP BY url)")
+            conn.execute("DELETE FROM story_bands WHERE story_id NOT IN (SELECT id FROM stories)")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS stories_url ON stories (url)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, articles):
+        """Remembers articles that went into a digest. An article recorded before (same URL) is updated, not added again."""
+        now = time.time()
+        with self._connect() as conn:
+            for article in articles:
+                signature = self.hasher.signature(article_text(article))
+                row = conn.execute("SELECT id FROM stories WHERE url = ?", (article.get('url'),)).fetchone()
+                if row:
+                    story_id = row[0]
+                    conn.execute("UPDATE stories SET title = ?, signature = ?, covered_at = ? WHERE id = ?",
+                                 (article.get('title'), json.dumps(signature), now, story_id))
+                    conn.execute("DELETE FROM story_bands WHERE story_id = ?", (story_id,))
+                else:
+                    story_id = conn.execute("INSERT INTO stories (url, title, signature, covered_at) VALUES (?, ?, ?, ?)",
+                                            (article.get('url'), article.get('title'), json.dumps(signature), now)).lastrowid
+                conn.executemany("INSERT INTO story_bands (band, story_id) VALUES (?, ?)", [(band, story_id) for band in band_keys(signature)])
+            cutoff = now - self.keep_days * 86400
+            conn.execute("DELETE FROM story_bands WHERE story_id IN (SELECT id FROM stories WHERE covered_at < ?)", (cutoff,))
+            conn.execute("DELETE FROM stories WHERE covered_at < ?", (cutoff,))
+
+    def find(self, signatures, urls, threshold=DEDUP_THRESHOLD):
+        """For each (signature, url): the earlier story it repeats, as {'url', 'title', 'covered_at'}, or None."""
+        matches = []
+        with self._connect() as conn:
+            for signature, url in zip(signatures, urls):
+                bands = band_keys(signature)
+                rows = conn.execute(f"SELECT s.url, s.title, s.signature, s.covered_at FROM stories s WHERE s.url = ? OR s.id IN "
+                                    f"(SELECT story_id FROM story_bands WHERE band IN ({', '.join('?' * len(bands))}))", [url] + bands).fetchall()
+                matches.append(next(({'url': story_url, 'title': title, 'covered_at': covered_at} for story_url, title, stored, covered_at in rows
+                                     if story_url == url or similarity(signature, json.loads(stored)) >= threshold), None))
+        return matches
+
+
+def article_text(article):
+    return f"{article.get('title', '')} {article.get('snippet', '')}"
+
+
+def selection_criteria(step2_prompt):
+    """(prioritize, avoid) lists from the step 2 prompt JSON; empty if it cannot be read."""
+    try:
+        criteria = json.loads(step2_prompt).get('criteria') or {}
+    except (TypeError, AttributeError, json.JSONDecodeError):
+        return [], []
+    return list(criteria.get('prioritize') or []), list(criteria.get('avoid') or [])
+
+
+def priority_score(text, prioritize=(), avoid=()):
+    """How well a candidate matches the step 2 criteria: +1 per matched `prioritize` criterion, -1 per `avoid` one."""
+    text = text.lower()
+    words = set(WORD_RE.findall(text))
+    def matches(criterion):
+        keywords = PRIORITY_KEYWORDS.get(criterion.lower()) or WORD_RE.findall(criterion.lower())
+        return any((keyword in words) if keyword.isalnum() else (keyword in text) for keyword in keywords)
+    # "reposts" is handled by the duplicate grouping, not by keywords
+    return sum(matches(c) for c in prioritize) - sum(matches(c) for c in avoid if c.lower() != "reposts")
+
+
+def rank_candidates(articles, prioritize=(), avoid=(), history=None, hasher=None):
+    """
+    Groups near-duplicate candidates (syndicated copies of one story) and
+    ranks them for step 2. Each group is represented by its best-placed
+    search result, and stories syndicated widely get a small boost. Copies come
+    last with 'duplicate_of' set; stories found in `history` sink below fresh
+    ones with 'covered' set. Every article gets a 'score' and 'duplicates' count.
+    """
+    hasher = hasher or MinHasher()
+    with tracer.span('dedup', candidates=len(articles)) as span:
+        index, group_of = CandidateIndex(), {}
+        signatures = [hasher.signature(article_text(article)) for article in articles]
+        for position, signature in enumerate(signatures):
+            # Join the group of the earliest similar result, or start a new one.
+            similar = index.similar(signature)
+            group_of[position] = min((group_of[other] for other in similar), default=position)
+            index.add(position, signature)
+
+        group_sizes = {}
+        for group in group_of.values(): group_sizes[group] = group_sizes.get(group, 0) + 1
+
+        covered = history.find(signatures, [article.get('url') for article in articles]) if history else [None] * len(articles)
+        ranked = []
+        for position, article in enumerate(articles):
+            group = group_of[position]
+            article = dict(article, duplicates=group_sizes[group] - 1)
+            score = priority_score(article_text(article), prioritize, avoid) + math.log1p(group_sizes[group] - 1) + 1.0 / (1 + position)
+            if group != position: article['duplicate_of'] = articles[group]['url']
+            if covered[position]: article['covered'] = covered[position]['url']
+            article['score'] = round(score, 3)
+            ranked.append(article)
+        span['duplicates'] = sum('duplicate_of' in article for article in ranked)
+        span['covered'] = sum('covered' in article for article in ranked)
+    return sorted(ranked, key=lambda a: ('duplicate_of' in a, 'covered' in a, -a['score']))
+
+
+def make_story_history():
+    """Builds the covered-story history configured by the DEDUP_HISTORY_* variables, or None when disabled."""
+    return CoveredStories() if DEDUP_HISTORY_ENABLED else None
@@ -1,12 +1,22 @@
 # digest_logic.py
 
+import contextvars
 import os
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from dotenv import load_dotenv
 import json
 import markdown2
 import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from fetch_cache import make_fetch_cache, make_key, normalize_url
+from http_client import make_http_client
+from tracing import tracer
+from compaction import compact_articles, COMPACT_PER_ARTICLE_TOKENS, COMPACT_TOTAL_TOKENS
 
 # ... (Configuration is unchanged) ...
 load_dotenv()
@@ -14,53 +24,329 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
 HEADERS = {'User-Agent': 'Mozilla/5.0 ...'} # a long user agent string
 
+# Batch scraping limits (see get_articles_content)
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "8"))
+SCRAPE_PER_HOST_LIMIT = int(os.getenv("SCRAPE_PER_HOST_LIMIT", "2"))
+SCRAPE_BATCH_DEADLINE = float(os.getenv("SCRAPE_BATCH_DEADLINE", "20"))
+
+# Article extraction limits (see get_article_content)
+ARTICLE_MAX_BYTES = int(os.getenv("ARTICLE_MAX_BYTES", str(2 * 1024 * 1024)))
+ARTICLE_MAX_CHARS = int(os.getenv("ARTICLE_MAX_CHARS", "20000"))
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+ARTICLE_REGION_TAGS = ['article', 'main']
+ARTICLE_MIN_REGION_CHARS = 200 # less text than this in <article>/<main> means they are not the real article
+ARTICLE_BOILERPLATE_TAGS = ['nav', 'header', 'footer', 'aside', 'form', 'script', 'style', 'noscript']
+
+# Shared on-disk cache for search results and article pages (None when FETCH_CACHE_ENABLED=0)
+FETCH_CACHE = make_fetch_cache()
+# Shared pooled HTTP client; every outgoing request goes through it
+HTTP = make_http_client()
+SEARCH_URL = os.getenv("CUSTOM_SEARCH_URL", "https://www.googleapis.com/customsearch/v1") # overridden by the offline benchmarks
+SEARCH_PAGE_SIZE = 10 # Custom Search returns at most 10 results per call...
+SEARCH_MAX_RESULTS = 100 # ...and none past the 100th
+
+def get_default_prompts():
+    """The editable JSON prompts for steps 1-3 of the workflow."""
+    prompts = { "step1": json.dumps({ "task": "find_articles", "query": "latest digital fraud and cybercrime news", "parameters": { "timeframe": "last_7_days", "num_articles": 10, "sort_by": "relevance" } }, indent=2), "step2": json.dumps({ "task": "select_best_articles", "selection_count": 5, "criteria": { "prioritize": ["new threats", "major financial impact"], "avoid": ["reposts"] }, "token_budget": { "per_article": COMPACT_PER_ARTICLE_TOKENS, "total": COMPACT_TOTAL_TOKENS } }, indent=2), "step3": json.dumps({ "task": "generate_analytical_note", "articles_data": "PLACEHOLDER", "output_format": { "title": "Beyond the Breach: Why Digital Fraud Flies Under the Radar", "style": "analytical_review", "include": ["synthesized_intro", "detailed_analysis_with_quotes", "key_takeaways", "source_links_list"] } }, indent=2) }
+    return prompts
+
+# --- HTTP Helpers ---
+def cached_get(url, params=None, headers=None, timeout=None, kind="page", max_bytes=None, accept_types=None):
+    """
+    GETs `url` through FETCH_CACHE and returns {'body', 'content_type', 'from_cache', 'truncated'}.
+    Stale entries are revalidated with If-None-Match/If-Modified-Since. The
+    API key is left out of the cache key. Network calls go through the shared
+    HTTP client (pooling, retries, per-`kind` stats). The body is streamed and cut off at
+    `max_bytes`; if `accept_types` is given and the response declares a
+    Content-Type that matches none of them, the download is abandoned and
+    'body' is None. Responses without a Content-Type are read. Raises requests
+    exceptions like requests.get.
+    """
+    key_params = {k: v for k, v in (params or {}).items() if k != 'key'}
+    if max_bytes: key_params['_max_bytes'] = max_bytes # a body cut at one cap must not be served for a larger one
+    key = make_key(kind, url, key_params)
+    cached = FETCH_CACHE.get(key) if FETCH_CACHE else None
+    if cached and cached['fresh']:
+        tracer.count('cache_lookups', kind=kind, result='hit')
+        return {'body': cached['body'], 'content_type': cached['content_type'], 'from_cache': True, 'truncated': False}
+
+    request_headers = dict(headers or {})
+    if cached:
+        if cached['etag']: request_headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']: request_headers['If-Modified-Since'] = cached['last_modified']
+    with HTTP.get(url, params=params, headers=request_headers, timeout=timeout, stream=True, endpoint=kind) as response:
+        if cached and response.status_code == 304:
+            FETCH_CACHE.refresh(key)
+            tracer.count('cache_lookups', kind=kind, result='revalidated')
+            return {'body': cached['body'], 'content_type': cached['content_type'], 'from_cache': True, 'truncated': False}
+        response.raise_for_status()
+        if FETCH_CACHE: tracer.count('cache_lookups', kind=kind, result='miss')
+        content_type = response.headers.get('Content-Type')
+        if accept_types and content_type and not any(t in content_type.lower() for t in accept_types):
+            return {'body': None, 'content_type': content_type, 'from_cache': False, 'truncated': False}
+        body, truncated = _read_body(response, max_bytes)
+    if FETCH_CACHE:
+        FETCH_CACHE.put(key, body, content_type, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    return {'body': body, 'content_type': content_type, 'from_cache': False, 'truncated': truncated}
+
+def _read_body(response, max_bytes=None):
+    """Reads a streamed response, stopping after `max_bytes`. Returns (body, truncated)."""
+    if not max_bytes: return response.content, False
+    chunks, size = [], 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= max_bytes: return b"".join(chunks)[:max_bytes], True
+    return b"".join(chunks), False
+
 # --- Core Functions ---
 def search_articles(query, num_to_fetch=10): # MODIFIED: Accepts query and number
-    """Searches Google for recent articles."""
+    """
+    Searches Google for recent articles. Requests above the API's 10-per-call
+    cap are split into pages fetched concurrently; results come back in rank
+    order with duplicate URLs removed.
+    """
     print(f"🔍 Searching for {num_to_fetch} articles with query: '{query}'...")
-    if not GOOGLE_API_KEY or not SEARCH_ENGINE_ID: return []
-    url = "https://www.googleapis.com/customsearch/v1"
-    params = {'key': GOOGLE_API_KEY, 'cx': SEARCH_ENGINE_ID, 'q': query, 'num': num_to_fetch, 'sort': 'date'}
-    try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        search_results = response.json()
-        if 'items' not in search_results: return []
-        return [{'title': item['title'], 'url': item['link'], 'snippet': item.get('snippet', '')} for item in search_results['items']]
-    except requests.exceptions.RequestException as e:
-        print(f"❌ A network error occurred: {e}")
-        return []
+    with tracer.span('search', num=num_to_fetch) as span:
+        articles = merge_search_pages(dict(iter_search_pages(query, num_to_fetch, dedupe=False)), num_to_fetch)
+        span['results'] = len(articles)
+    return articles
+
+def merge_search_pages(pages, num_to_fetch):
+    """Joins {start: articles} pages from iter_search_pages in rank order, without duplicate URLs, up to `num_to_fetch`."""
+    seen, articles = set(), []
+    for start in sorted(pages):
+        articles += _drop_seen_articles(pages[start], seen)
+    return articles[:num_to_fetch]
+
+def search_page_count(num_to_fetch):
+    """How many Custom Search calls iter_search_pages makes for `num_to_fetch` results."""
+    return len(_search_page_starts(num_to_fetch))
+
+def _search_page_starts(num_to_fetch):
+    return range(1, max(1, min(int(num_to_fetch), SEARCH_MAX_RESULTS)) + 1, SEARCH_PAGE_SIZE)
+
+def iter_search_pages(query, num_to_fetch=10, dedupe=True):
+    """
+    Fetches every page needed for `num_to_fetch` results in parallel and yields
+    (start, articles) as each page arrives. With `dedupe`, articles already
+    yielded from an earlier page (same canonical URL) are left out, so a
+    caller can show candidates as soon as the first page lands.
+    """
+    if not GOOGLE_API_KEY or not SEARCH_ENGINE_ID: return
+    num_to_fetch = max(1, min(int(num_to_fetch), SEARCH_MAX_RESULTS))
+    page_starts = _search_page_starts(num_to_fetch)
+    seen = set()
+    with ThreadPoolExecutor(max_workers=len(page_starts), thread_name_prefix="search") as executor:
+        futures = {executor.submit(contextvars.copy_context().run, _search_page, query, start, min(SEARCH_PAGE_SIZE, num_to_fetch - start + 1)): start for start in page_starts}
+        for future in as_completed(futures):
+            try:
+                page = future.result()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"❌ A network error occurred (results from {futures[future]}): {e}")
+                continue
+            yield futures[future], _drop_seen_articles(page, seen) if dedupe else page
+
+def _drop_seen_articles(articles, seen):
+    """Filters out articles whose canonical URL is in `seen`, adding the kept ones to it."""
+    kept = []
+    for article in articles:
+        canonical_url = normalize_url(article['url'])
+        if canonical_url in seen: continue
+        seen.add(canonical_url)
+        kept.append(article)
+    return kept
+
+def _search_page(query, start, num):
+    """One Custom Search call for results start..start+num-1."""
+    params = {'key': GOOGLE_API_KEY, 'cx': SEARCH_ENGINE_ID, 'q': query, 'num': num, 'start': start, 'sort': 'date'}
+    with tracer.span('search.page', start=start) as span:
+        response = cached_get(SEARCH_URL, params=params, kind="search")
+        span.update(bytes=len(response['body']), cache=response['from_cache'])
+    search_results = json.loads(response['body'])
+    return [{'title': item['title'], 'url': item['link'], 'snippet': item.get('snippet', '')} for item in search_results.get('items', [])]
 
 # NEW: Function to search for an image
+# Image lookups run on their own small pool and are remembered per query, so the
+# generator can pick up URLs that were resolved while the articles were being scraped.
+IMAGE_PLACEHOLDER_URL = "https://via.placeholder.com/600x400.png?text=Image+Not+Found"
+IMAGE_LOOKUP_WORKERS = int(os.getenv("IMAGE_LOOKUP_WORKERS", "4"))
+IMAGE_LOOKUP_WAIT = float(os.getenv("IMAGE_LOOKUP_WAIT", "2")) # longest the generator waits for pending lookups, in total
+IMAGE_LOOKUP_CACHE_SIZE = 512
+_image_executor = ThreadPoolExecutor(max_workers=IMAGE_LOOKUP_WORKERS, thread_name_prefix="image")
+_image_lookups = OrderedDict() # normalized query -> Future[url]
+_image_lookups_lock = threading.Lock()
+
 def find_image_url(query):
     """Searches for a single, relevant image URL."""
     print(f"🖼️ Searching for image with query: '{query}'...")
     try:
-        url = "https://www.googleapis.com/customsearch/v1"
         params = {'key': GOOGLE_API_KEY, 'cx': SEARCH_ENGINE_ID, 'q': query, 'num': 1, 'searchType': 'image', 'imgSize': 'large'}
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        results = response.json()
+        with tracer.span('image.search') as span:
+            response = cached_get(SEARCH_URL, params=params, kind="image")
+            span.update(bytes=len(response['body']), cache=response['from_cache'])
+        results = json.loads(response['body'])
         if 'items' in results and len(results['items']) > 0:
             return results['items'][0]['link']
     except Exception as e:
         print(f"   - ❗️ Image search failed: {e}")
-    return "https://via.placeholder.com/600x400.png?text=Image+Not+Found" # Fallback
+    return IMAGE_PLACEHOLDER_URL # Fallback
+
+def prefetch_images(queries):
+    """Starts background image lookups for `queries` so they are resolved before generation needs them."""
+    for query in queries: _image_lookup(query)
+
+def resolve_image_urls(queries, timeout=None):
+    """
+    Returns {query: image_url}, reusing prefetched lookups and starting the
+    missing ones concurrently. Waits at most `timeout` seconds in total;
+    lookups that are still running get the placeholder.
+    """
+    timeout = IMAGE_LOOKUP_WAIT if timeout is None else timeout
+    futures = {query: _image_lookup(query) for query in queries}
+    wait(futures.values(), timeout=timeout)
+    return {query: future.result() if future.done() else IMAGE_PLACEHOLDER_URL for query, future in futures.items()}
+
+def _image_lookup(query):
+    """The (possibly still running) lookup for `query`. Results are kept per query; placeholders are retried."""
+    key = " ".join(query.lower().split())
+    with _image_lookups_lock:
+        future = _image_lookups.get(key)
+        if future is None or (future.done() and future.result() == IMAGE_PLACEHOLDER_URL):
+            future = _image_lookups[key] = _image_executor.submit(contextvars.copy_context().run, find_image_url, query)
+        _image_lookups.move_to_end(key)
+        while len(_image_lookups) > IMAGE_LOOKUP_CACHE_SIZE: _image_lookups.popitem(last=False)
+    return future
 
 # ... (get_article_content is unchanged) ...
-def get_article_content(url):
+def get_article_content(url, max_bytes=None, max_chars=None):
+    """
+    Scrapes the main text of an article. The body is streamed and capped at
+    `max_bytes`, non-HTML responses are skipped before download, and only the
+    article region is parsed (see extract_article_text).
+    """
+    max_bytes = max_bytes or ARTICLE_MAX_BYTES
+    max_chars = max_chars or ARTICLE_MAX_CHARS
     try:
         print(f"   - Scraping article: {url}")
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        paragraphs = soup.find_all('p')
-        text_content = "\n".join([p.get_text() for p in paragraphs])
+        with tracer.span('scrape.fetch', host=urlsplit(url).netloc) as span:
+            response = cached_get(url, headers=HEADERS, kind="page", max_bytes=max_bytes, accept_types=HTML_CONTENT_TYPES)
+            span.update(bytes=len(response['body'] or b''), cache=response['from_cache'], truncated=response['truncated'])
+        if response['body'] is None:
+            return {"status": "warning", "content": f"Skipped non-HTML content ({response['content_type']})."}
+        with tracer.span('scrape.parse', bytes=len(response['body'])) as span:
+            text_content = extract_article_text(response['body'], max_chars)
+            span['chars'] = len(text_content)
         if not text_content: return {"status": "warning", "content": "Could not extract meaningful content."}
         return {"status": "success", "content": text_content}
     except requests.exceptions.RequestException as e:
         return {"status": "error", "content": f"Failed to fetch article: {e}"}
 
+def extract_article_text(html, max_chars=None):
+    """
+    Returns the text of the article's paragraphs, one per line, stopping once
+    `max_chars` are collected. Only <article>/<main> regions are parsed when the
+    page has them; otherwise the page is parsed without its navigation and
+    boilerplate, and the container holding most of the paragraph text wins.
+    """
+    region = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer(ARTICLE_REGION_TAGS))
+    paragraphs = _paragraph_texts(region.find_all('p'))
+    if sum(len(text) for text in paragraphs) < ARTICLE_MIN_REGION_CHARS:
+        paragraphs = _densest_paragraphs(BeautifulSoup(html, 'html.parser'))
+
+    collected, size = [], 0
+    for text in paragraphs:
+        collected.append(text)
+        size += len(text) + 1
+        if max_chars and size >= max_chars: break
+    return "\n".join(collected)
+
+def _paragraph_texts(paragraphs):
+    return [text for text in (p.get_text().strip() for p in paragraphs) if text]
+
+def _densest_paragraphs(soup):
+    """Readability-style fallback: drop boilerplate, then keep the paragraphs of the densest container."""
+    for tag in soup.find_all(ARTICLE_BOILERPLATE_TAGS): tag.decompose()
+    paragraphs = soup.find_all('p')
+    text_by_parent = {}
+    for p in paragraphs:
+        text_by_parent[id(p.parent)] = text_by_parent.get(id(p.parent), 0) + len(p.get_text().strip())
+    total = sum(text_by_parent.values())
+    if not total: return []
+    densest_parent, densest_size = max(text_by_parent.items(), key=lambda item: item[1])
+    if densest_size < total / 2: return _paragraph_texts(paragraphs) # text is spread out; keep everything that's left
+    return _paragraph_texts(p for p in paragraphs if id(p.parent) == densest_parent)
+
+def get_articles_content(urls, max_workers=None, per_host_limit=None, deadline=None, on_result=None):
+    """
+    Scrapes several articles concurrently through a bounded thread pool.
+    At most `per_host_limit` requests hit the same host at once, and the whole
+    batch is abandoned after `deadline` seconds. Returns one
+    {'status', 'content'} dict per URL, in the same order as `urls`.
+    `on_result(index, result)` is called as each article finishes.
+    """
+    urls = list(urls)
+    if not urls: return []
+    max_workers = max_workers or SCRAPE_MAX_WORKERS
+    per_host_limit = per_host_limit or SCRAPE_PER_HOST_LIMIT
+    deadline = SCRAPE_BATCH_DEADLINE if deadline is None else deadline
+
+    host_slots = {urlsplit(url).netloc.lower(): threading.BoundedSemaphore(per_host_limit) for url in urls}
+
+    def scrape(url):
+        with host_slots[urlsplit(url).netloc.lower()]:
+            with tracer.span('scrape', host=urlsplit(url).netloc):
+                return get_article_content(url)
+
+    print(f"📰 Scraping {len(urls)} articles (workers={max_workers}, per_host={per_host_limit}, deadline={deadline}s)...")
+    results = [None] * len(urls)
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(urls)), thread_name_prefix="scrape")
+    try:
+        futures = {executor.submit(contextvars.copy_context().run, scrape, url): i for i, url in enumerate(urls)}
+        pending, end_at = set(futures), time.monotonic() + deadline
+        while pending:
+            remaining = end_at - time.monotonic()
+            if remaining <= 0: break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    results[i] = {"status": "error", "content": f"Failed to fetch article: {e}"}
+                if on_result: on_result(i, results[i])
+    finally:
+        # Don't wait for stragglers: they finish in the background and are discarded.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = {"status": "error", "content": f"Failed to fetch article: batch deadline of {deadline}s exceeded"}
+    return results
+
+def prefetch_digest_images(selected_articles):
+    """Starts the image lookups the step 3 generator will need for these articles (default note title)."""
+    note_title = json.loads(get_default_prompts()['step3'])['output_format']['title']
+    prefetch_images([note_title] + [article['title'] for article in selected_articles])
+
+def build_step3_prompt(selected_articles, scrape_results, token_budget=None):
+    """
+    Fills the default step 3 prompt with the scraped articles, compacted to
+    `token_budget` ({'per_article', 'total'}, as in the step 2 prompt).
+    Returns (prompt_json_str, scrape_error_count, compaction_report).
+    """
+    scraped_articles_data, scrape_error_count = [], 0
+    for article, scrape_result in zip(selected_articles, scrape_results):
+        scraped_articles_data.append({'title': article['title'], 'url': article['url'], 'scrape_status': scrape_result['status'], 'content': scrape_result['content']})
+        if scrape_result['status'] == 'error': scrape_error_count += 1
+    token_budget = token_budget or {}
+    with tracer.span('compact') as span:
+        scraped_articles_data, compaction_report = compact_articles(scraped_articles_data, token_budget.get('per_article'), token_budget.get('total'))
+        span.update(original_tokens=compaction_report['original_tokens'], compacted_tokens=compaction_report['compacted_tokens'])
+    prompt_step3_template = json.loads(get_default_prompts()['step3'])
+    prompt_step3_template['articles_data'] = scraped_articles_data
+    return json.dumps(prompt_step3_template, indent=2), scrape_error_count, compaction_report
+
 # ==============================================================================
 # COMPLETELY REWRITTEN AI SIMULATION FOR ANALYTICAL NOTE
 # ==============================================================================
@@ -74,6 +360,8 @@ def simulate_ai_digest_generation(prompt_json_str):
         articles = data.get('articles_data', [])
         output_format = data.get('output_format', {})
         note_title = output_format.get('title', "Weekly Threat Analysis")
+        # All illustrations are looked up together (most were prefetched in step 2)
+        images = resolve_image_urls([note_title] + [article.get('title', 'Untitled') for article in articles])
         
         # --- Synthesize the intro from all articles ---
         intro_paragraph = "The news is full of headlines about major cyberattacks... But another, equally damaging threat operates quietly in the background: digital fraud. "
@@ -81,7 +369,7 @@ def simulate_ai_digest_generation(prompt_json_str):
         
         # Start building the Markdown
         final_md = f"# {note_title}\n\n"
-        final_md += f"![Main illustration for the analytical note]( {find_image_url(note_title)} )\n\n" # Main image
+        final_md += f"![Main illustration for the analytical note]( {images[note_title]} )\n\n" # Main image
         final_md += f"{intro_paragraph}\n\n"
 
         # --- Create detailed analysis for each article ---
@@ -93,6 +381,7 @@ def simulate_ai_digest_generation(prompt_json_str):
             if article['scrape_status'] == 'error':
                 final_md += f"_{content}_\n\n"
             else:
+                final_md += f"![Illustration: {title}]( {images[title]} )\n\n"
                 paragraphs = content.split('\n')
                 body = "\n\n".join(paragraphs[:2]) if len(paragraphs) > 1 else content
                 pull_quote = paragraphs[2] if len(paragraphs) > 2 else "This represents a continuous financial drain on businesses, affecting everything from operational overhead to brand reputation."
@@ -109,23 +398,62 @@ def simulate_ai_digest_generation(prompt_json_str):
     except Exception as e:
         return {"status": "error", "markdown_digest": f"Failed to simulate AI generation: {e}"}
 
-# ... (convert_markdown_to_tilda_html and generate_final_prompt_from_json are unchanged) ...
-def convert_markdown_to_tilda_html(markdown_text):
-    html = markdown2.markdown(markdown_text, extras=["smarty-pants"])
-    soup = BeautifulSoup(html, 'html.parser')
-    FONT_FAMILY = "'-apple-system', 'BlinkMacSystemFont', 'Segoe UI', 'Roboto', 'Helvetica', 'Arial', sans-serif"
-    for tag in soup.find_all(['h1', 'h3', 'p', 'a', 'em', 'strong', 'li']): tag['style'] = f"font-family: {FONT_FAMILY};"
-    for h1 in soup.find_all('h1'): h1['style'] += "font-size: 42px; font-weight: 700; color: #111; line-height: 1.2;"
-    for h3 in soup.find_all('h3'): h3['style'] += "font-size: 24px; font-weight: 600; color: #111; line-height: 1.3;"
-    for p in soup.find_all('p'): p['style'] += "font-size: 18px; color: #333; line-height: 1.6;"
-    for img in soup.find_all('img'): img['style'] = "max-width: 100%; height: auto; border-radius: 8px; margin-bottom: 20px;"
-    for blockquote in soup.find_all('blockquote'):
-        blockquote['style'] = "border-left: 3px solid #333; padding-left: 25px; margin: 20px 0;"
-        if p_tag := blockquote.find('p'): p_tag['style'] = f"font-family: {FONT_FAMILY}; font-size: 22px; font-style: italic; color: #111;"
-    for a in soup.find_all('a'):
-        a['target'] = '_blank'
-        a['style'] += "color: #007bff; text-decoration: none;"
-    return soup.prettify()
+# --- Tilda Styling ---
+TILDA_FONT_FAMILY = "'-apple-system', 'BlinkMacSystemFont', 'Segoe UI', 'Roboto', 'Helvetica', 'Arial', sans-serif"
+TILDA_FONT_STYLE = f"font-family: {TILDA_FONT_FAMILY};"
+# Inline style (and extra attributes) per tag name, applied in a single pass over the tree.
+TILDA_STYLE_RULES = {
+    'h1': TILDA_FONT_STYLE + "font-size: 42px; font-weight: 700; color: #111; line-height: 1.2;",
+    'h3': TILDA_FONT_STYLE + "font-size: 24px; font-weight: 600; color: #111; line-height: 1.3;",
+    'p': TILDA_FONT_STYLE + "font-size: 18px; color: #333; line-height: 1.6;",
+    'a': TILDA_FONT_STYLE + "color: #007bff; text-decoration: none;",
+    'em': TILDA_FONT_STYLE,
+    'strong': TILDA_FONT_STYLE,
+    'li': TILDA_FONT_STYLE,
+    'img': "max-width: 100%; height: auto; border-radius: 8px; margin-bottom: 20px;",
+    'blockquote': "border-left: 3px solid #333; padding-left: 25px; margin: 20px 0;",
+}
+TILDA_EXTRA_ATTRS = {'a': {'target': '_blank'}}
+# The first <p> inside a blockquote is rendered as a pull quote instead of a body paragraph.
+TILDA_QUOTE_STYLE = f"font-family: {TILDA_FONT_FAMILY}; font-size: 22px; font-style: italic; color: #111;"
+TILDA_HTML_PARSER = os.getenv("TILDA_HTML_PARSER", "html.parser") # any BeautifulSoup parser; timings barely differ
+# markdown2's run time grows with the square of the document size, so long digests
+# are converted one heading section at a time. Reference-style link definitions and
+# raw HTML blocks can reach across sections; documents with them are converted whole.
+MARKDOWN_SECTION_RE = re.compile(r'\n\n+(?=#{1,6} )')
+MARKDOWN_WHOLE_DOCUMENT_RE = re.compile(r'^ {0,3}(\[[^\]]+\]:|<(?!a[\s>])[a-zA-Z])', re.M)
+
+def convert_markdown_to_tilda_html(markdown_text, parser=None, minify=False):
+    """
+    Renders Markdown to HTML with inline Tilda styles. Styles come from
+    TILDA_STYLE_RULES in one walk over the tree. `parser` picks the
+    BeautifulSoup parser; `minify` skips prettify() and returns compact markup.
+    """
+    with tracer.span('tilda.markdown', bytes=len(markdown_text.encode('utf-8'))):
+        html = _markdown_to_html(markdown_text)
+    with tracer.span('tilda.style', bytes=len(html.encode('utf-8'))):
+        return _style_tilda_html(html, parser or TILDA_HTML_PARSER, minify)
+
+def _markdown_to_html(markdown_text):
+    if MARKDOWN_WHOLE_DOCUMENT_RE.search(markdown_text):
+        return markdown2.markdown(markdown_text, extras=["smarty-pants"])
+    return "\n".join(markdown2.markdown(section, extras=["smarty-pants"]) for section in MARKDOWN_SECTION_RE.split(markdown_text))
+
+def _style_tilda_html(html, parser, minify):
+    soup = BeautifulSoup(html, parser)
+    if parser != 'html.parser' and soup.body is not None:
+        # Document parsers such as lxml wrap the fragment in <html><body>; keep just the fragment.
+        soup.body.unwrap()
+        soup.html.unwrap()
+
+    quote_paragraphs = set()
+    for tag in soup.find_all(True):
+        if tag.name == 'blockquote' and (p_tag := tag.find('p')): quote_paragraphs.add(id(p_tag))
+        style = TILDA_QUOTE_STYLE if id(tag) in quote_paragraphs else TILDA_STYLE_RULES.get(tag.name)
+        if style is None: continue
+        tag['style'] = style
+        for attr, value in TILDA_EXTRA_ATTRS.get(tag.name, {}).items(): tag[attr] = value
+    return str(soup) if minify else soup.prettify()
 
 def generate_final_prompt_from_json(prompt_json_str):
     # This function is now less critical but kept for completeness
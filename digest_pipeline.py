@@ -0,0 +1,168 @@
+# digest_pipeline.py
+#
+# Headless version of the app.py workflow: search -> select -> scrape ->
+# generate -> Tilda HTML, for one or many queries, without a browser.
+#
+#   python digest_pipeline.py "latest digital fraud news" "ransomware healthcare" --out-dir digests
+#   python digest_pipeline.py --queries-file weekly_queries.txt --concurrency 4
+#
+# All runs in a process share digest_logic's HTTP connection pool and fetch cache.
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import dedup
+import digest_logic as dl
+import tracing
+
+DEFAULT_OUT_DIR = "digests"
+# Shared by all runs in the process, like the web app's history.
+covered_stories = dedup.make_story_history()
+
+
+def select_articles(candidates, count):
+    """
+    Automatic stand-in for the editor's step 2 choice: takes candidates in
+    rank order (see dedup.rank_candidates), skipping near-duplicates and
+    already covered stories and preferring one article per site, then fills
+    up with the rest.
+    """
+    selected, hosts = [], set()
+    for article in candidates:
+        if 'duplicate_of' in article or 'covered' in article: continue
+        host = urlsplit(article['url']).netloc.lower()
+        if host in hosts: continue
+        hosts.add(host)
+        selected.append(article)
+        if len(selected) == count: return selected
+    selected += [article for article in candidates if article not in selected][:count - len(selected)]
+    return selected
+
+
+def run_digest(query, num_articles=10, select_count=None, out_dir=DEFAULT_OUT_DIR, minify=False):
+    """
+    Runs the whole pipeline for one query in a new folder under `out_dir`:
+    digest.md and digest.html on success, and run.json (the returned summary)
+    either way.
+    """
+    started = time.perf_counter()
+    step2_prompt = dl.get_default_prompts()['step2']
+    select_count = select_count or json.loads(step2_prompt).get('selection_count', 5)
+    prioritize, avoid = dedup.selection_criteria(step2_prompt)
+    run_dir = make_run_dir(out_dir, query)
+    summary = {'query': query, 'status': 'error', 'output_dir': run_dir}
+
+    with tracing.trace() as spans:
+        candidates = dedup.rank_candidates(dl.search_articles(query, num_articles), prioritize, avoid, history=covered_stories)
+        summary['candidates'] = len(candidates)
+        summary['near_duplicates'] = sum('duplicate_of' in article for article in candidates)
+        summary['already_covered'] = sum('covered' in article for article in candidates)
+        if len(candidates) < select_count:
+            summary['message'] = f"Found {len(candidates)} articles, need {select_count}."
+        else:
+            selected = select_articles(candidates, select_count)
+            dl.prefetch_digest_images(selected)
+            scrape_results = dl.get_articles_content([article['url'] for article in selected])
+            prompt_step3, scrape_error_count, summary['compaction'] = dl.build_step3_prompt(selected, scrape_results)
+            summary['articles'] = [{'title': article['title'], 'url': article['url'], 'scrape_status': result['status']}
+                                   for article, result in zip(selected, scrape_results)]
+            summary['scrape_errors'] = scrape_error_count
+
+            ai_result = dl.simulate_ai_digest_generation(prompt_step3)
+            if ai_result['status'] != 'success':
+                summary['message'] = ai_result['markdown_digest']
+            else:
+                markdown_digest = ai_result['markdown_digest']
+                tilda_html = dl.convert_markdown_to_tilda_html(markdown_digest, minify=minify)
+                write_text(os.path.join(run_dir, "digest.md"), markdown_digest)
+                write_text(os.path.join(run_dir, "digest.html"), tilda_html)
+                summary['status'] = 'success'
+                if covered_stories: covered_stories.record(selected)
+                summary['message'] = f"Digest written with {scrape_error_count} scrape errors."
+
+    summary['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    summary['timings'] = tracing.summarize(spans)
+    write_text(os.path.join(run_dir, "run.json"), json.dumps(summary, indent=2, ensure_ascii=False))
+    return summary
+
+
+def run_digests(queries, concurrency=4, **options):
+    """Runs run_digest for every query on a thread pool. Returns the summaries in query order."""
+    if not queries: return []
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(queries)), thread_name_prefix="digest") as executor:
+        futures = [executor.submit(_safe_run_digest, query, **options) for query in queries]
+        return [future.result() for future in futures]
+
+
+def _safe_run_digest(query, **options):
+    # One failing query must not take the other runs down with it.
+    try:
+        return run_digest(query, **options)
+    except Exception as e:
+        return {'query': query, 'status': 'error', 'message': f"Pipeline failed: {e}"}
+
+
+def make_run_dir(out_dir, query):
+    """
+    Creates a new folder for one run: <timestamp>-<slug>-<query hash>. The
+    hash keeps non-Latin queries apart (they slugify to "digest"). A numeric
+    suffix separates runs of the same query started in the same second.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{slugify(query)}-{hashlib.sha1(query.encode('utf-8')).hexdigest()[:6]}"
+    for attempt in range(1, 1000):
+        run_dir = os.path.join(out_dir, name if attempt == 1 else f"{name}-{attempt}")
+        try:
+            os.mkdir(run_dir)
+            return run_dir
+        except FileExistsError:
+            continue
+    raise RuntimeError(f"Could not create a run folder for {query!r} in {out_dir}")
+
+
+def slugify(text, max_length=40):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:max_length] or "digest"
+
+
+def write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Produce Tilda-ready digests for one or more queries without the web UI.")
+    parser.add_argument("queries", nargs="*", help="search queries, one digest per query")
+    parser.add_argument("--queries-file", help="file with one query per line (blank lines and # comments are skipped)")
+    parser.add_argument("--num-articles", type=int, default=10, help="candidates to fetch per query (default: 10)")
+    parser.add_argument("--select", type=int, default=None, help="articles per digest (default: the step 2 prompt's selection_count)")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR, help=f"where run folders are created (default: {DEFAULT_OUT_DIR})")
+    parser.add_argument("--concurrency", type=int, default=4, help="digests generated at the same time (default: 4)")
+    parser.add_argument("--minify", action="store_true", help="write compact HTML instead of prettified HTML")
+    args = parser.parse_args(argv)
+
+    queries = list(args.queries)
+    if args.queries_file:
+        with open(args.queries_file, encoding="utf-8") as f:
+            queries += [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if not queries:
+        parser.error("give at least one query or --queries-file")
+
+    print(f"🚀 Generating {len(queries)} digest(s) with concurrency {args.concurrency}...")
+    summaries = run_digests(queries, concurrency=args.concurrency, num_articles=args.num_articles,
+                            select_count=args.select, out_dir=args.out_dir, minify=args.minify)
+    for summary in summaries:
+        icon = "✅" if summary['status'] == 'success' else "❌"
+        print(f"{icon} {summary['query']}: {summary.get('message', '')} {summary.get('output_dir', '')}")
+    return 0 if all(summary['status'] == 'success' for summary in summaries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# fetch_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# --- Configuration ---
+FETCH_CACHE_ENABLED = os.getenv("FETCH_CACHE_ENABLED", "1") not in ("0", "false", "no")
+FETCH_CACHE_PATH = os.getenv("FETCH_CACHE_PATH", "fetch_cache.sqlite3")
+FETCH_CACHE_TTL = int(os.getenv("FETCH_CACHE_TTL", str(6 * 3600)))
+FETCH_CACHE_MAX_BYTES = int(os.getenv("FETCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Query parameters that only track the visitor and never change the page.
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid')
+
+
+def normalize_url(url):
+    """Canonical form of a URL: lowercase scheme/host, no fragment, no tracking params, sorted query."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.endswith(':80') and parts.scheme == 'http': host = host[:-3]
+    if host.endswith(':443') and parts.scheme == 'https': host = host[:-4]
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.lower().startswith(TRACKING_PARAMS))
+    return urlunsplit((parts.scheme.lower(), host, parts.path or '/', urlencode(query), ''))
+
+
+def make_key(kind, target, params=None):
+    """Content address for a request: hash of its kind, normalized URL (or query) and parameters."""
+    if '://' in target: target = normalize_url(target)
+    raw = json.dumps([kind, target, sorted((params or {}).items())], ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class FetchCache:
+    """
+    On-disk cache of fetched bodies, keyed by make_key(). Entries older than
+    `ttl` seconds are reported as stale but kept, so callers can revalidate
+    them with a conditional GET using the stored ETag/Last-Modified. When the
+    stored bodies exceed `max_bytes`, the least recently used are evicted.
+    Hit/miss counters are kept in memory in `stats`.
+    """
+
+    def __init__(self, path=FETCH_CACHE_PATH, ttl=FETCH_CACHE_TTL, max_bytes=FETCH_CACHE_MAX_BYTES):
+        self.path, self.ttl, self.max_bytes = path, ttl, max_bytes
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, body BLOB NOT NULL, content_type TEXT, etag TEXT, last_modified TEXT,
+                size INTEGER NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        """
+        Returns {'body', 'content_type', 'etag', 'last_modified', 'fresh'} or None.
+        A stale entry counts as a miss unless the caller later calls refresh().
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT body, content_type, etag, last_modified, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        body, content_type, etag, last_modified, stored_at = row
+        fresh = time.time() - stored_at <= self.ttl
+        self._count('hits' if fresh else 'stale')
+        return {'body': bytes(body), 'content_type': content_type, 'etag': etag, 'last_modified': last_modified, 'fresh': fresh}
+
+    def put(self, key, body, content_type=None, etag=None, last_modified=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, body, content_type, etag, last_modified, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (key, body, content_type, etag, last_modified, len(body), now, now))
+            self._evict(conn)
+        self._count('stores')
+
+    def refresh(self, key):
+        """Marks a stale entry as fresh again after the origin answered 304 Not Modified."""
+        with self._connect() as conn:
+            conn.execute("UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?", (time.time(), time.time(), key))
+        self._count('revalidated')
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes: return
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            if total <= self.max_bytes: break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+        with self._stats_lock:
+            self.stats['evictions'] += len(victims)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def snapshot(self):
+        """Copy of the counters, plus the entry count and stored size."""
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._stats_lock:
+            return dict(self.stats, entries=entries, bytes=size)
+
+
+def make_fetch_cache():
+    """Builds the cache configured by the FETCH_CACHE_* variables, or None when caching is disabled."""
+    return FetchCache() if FETCH_CACHE_ENABLED else None
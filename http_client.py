@@ -0,0 +1,116 @@
+# http_client.py
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Configuration ---
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+HTTP_POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32")) # hosts with a kept-alive connection pool
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16")) # connections kept per host
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class HttpClient:
+    """
+    Pooled HTTP client shared by everything in digest_logic. One
+    requests.Session keeps connections alive per host; failed requests
+    (connection errors, timeouts, 429 and 5xx) are retried with exponential
+    backoff and jitter, waiting for Retry-After when the server sends it.
+    Latency, retries and errors are counted per endpoint in `stats`.
+    """
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), max_retries=HTTP_MAX_RETRIES,
+                 backoff_base=HTTP_BACKOFF_BASE, backoff_max=HTTP_BACKOFF_MAX, pool_hosts=HTTP_POOL_HOSTS, pool_size=HTTP_POOL_SIZE):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base, self.backoff_max = backoff_base, backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None, timeout=None, stream=False, endpoint=None):
+        """
+        Like requests.get, through the shared pool and with retries. `endpoint`
+        names the bucket the call is counted under (defaults to the host).
+        Returns the last response, even if it is an error status, or raises the
+        last connection error once retries run out.
+        """
+        endpoint = endpoint or urlsplit(url).netloc
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=timeout or self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(endpoint, time.perf_counter() - started, error=True)
+                if attempt == self.max_retries: raise
+                self._sleep(endpoint, self._backoff(attempt), type(e).__name__)
+                continue
+            self._record(endpoint, time.perf_counter() - started, error=response.status_code >= 400)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            delay = self._retry_after(response)
+            if delay is None: delay = self._backoff(attempt)
+            if delay > self.backoff_max: return response # the server asked us to come back much later; don't hold the caller
+            response.close()
+            self._sleep(endpoint, delay, f"HTTP {response.status_code}")
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _retry_after(response):
+        """Seconds to wait according to the Retry-After header, or None."""
+        value = response.headers.get("Retry-After")
+        if not value: return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _sleep(self, endpoint, delay, reason):
+        print(f"   - 🔁 Retrying {endpoint} in {delay:.1f}s ({reason})")
+        with self._stats_lock:
+            self._endpoint_stats(endpoint)['retries'] += 1
+        time.sleep(delay)
+
+    def _endpoint_stats(self, endpoint):
+        """Stats bucket for an endpoint. Caller holds the lock."""
+        return self.stats.setdefault(endpoint, {'requests': 0, 'errors': 0, 'retries': 0, 'latency_sum': 0.0, 'latency_max': 0.0})
+
+    def _record(self, endpoint, latency, error=False):
+        with self._stats_lock:
+            stats = self._endpoint_stats(endpoint)
+            stats['requests'] += 1
+            stats['errors'] += int(error)
+            stats['latency_sum'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+
+    def snapshot(self):
+        """Copy of the per-endpoint counters, with the average latency filled in."""
+        with self._stats_lock:
+            return {endpoint: dict(stats, latency_avg=stats['latency_sum'] / stats['requests'] if stats['requests'] else 0.0)
+                    for endpoint, stats in self.stats.items()}
+
+
+def make_http_client():
+    """Builds the client configured by the HTTP_* variables."""
+    return HttpClient()
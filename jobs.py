@@ -0,0 +1,98 @@
+# jobs.py
+
+import os
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# A running job whose record has not been updated for this long is reported as interrupted
+# (e.g. the worker process was restarted mid-step).
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+
+ACTIVE_STATES = ('queued', 'running')
+JOB_RESULT_KEY = 'job'
+
+
+class Job:
+    """Handle passed to a running step so it can report progress. Every update is persisted."""
+
+    def __init__(self, runner, workflow_id, record):
+        self.runner, self.workflow_id, self.record = runner, workflow_id, record
+
+    @property
+    def id(self):
+        return self.record['id']
+
+    def progress(self, done=None, total=None, event=None):
+        """Updates the done/total counters and appends `event` (a short text) to the job's event log."""
+        if done is not None: self.record['progress']['done'] = done
+        if total is not None: self.record['progress']['total'] = total
+        if event: self.record['events'].append(event)
+        self._save()
+
+    def _set_state(self, state, message=None):
+        self.record['state'] = state
+        if message is not None: self.record['message'] = message
+        self._save()
+
+    def _save(self):
+        self.record['updated_at'] = time.time()
+        self.runner.store.set_result(self.workflow_id, JOB_RESULT_KEY, self.record)
+
+
+class JobRunner:
+    """
+    Runs workflow steps on a local thread pool so that routes can return
+    immediately. The current job of each workflow is persisted in the
+    workflow store under the 'job' result key, so its status survives across
+    requests and is visible to every worker process sharing the store.
+    """
+
+    def __init__(self, store, max_workers=JOB_WORKERS, on_error=None):
+        self.store = store
+        self.on_error = on_error # on_error(workflow_id, message) runs after a step raises
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, workflow_id, step, fn, *args):
+        """
+        Queues fn(job, *args) for the workflow and returns the job ID, or None
+        if the workflow already has a job in progress.
+        """
+        now = time.time()
+        record = {'id': uuid.uuid4().hex, 'step': step, 'state': 'queued', 'message': '',
+                  'progress': {'done': 0, 'total': None}, 'events': [], 'submitted_at': now, 'updated_at': now}
+        # Check and claim in one atomic store update, so concurrent submits (a double click) start one job.
+        claim = lambda current: None if self.is_active(self._check_stale(current)) else record
+        if self.store.update_result(workflow_id, JOB_RESULT_KEY, claim) is not record: return None
+        job = Job(self, workflow_id, record)
+        self.executor.submit(self._run, job, fn, args)
+        return job.id
+
+    def _run(self, job, fn, args):
+        job._set_state('running')
+        try:
+            fn(job, *args)
+        except Exception as e:
+            traceback.print_exc()
+            job._set_state('failed', f"{job.record['step']} failed: {e}")
+            if self.on_error: self.on_error(job.workflow_id, job.record['message'])
+            return
+        job._set_state('done')
+
+    def current(self, workflow_id):
+        """The workflow's latest job record (with stale running jobs reported as failed), or None."""
+        return self._check_stale(self.store.get_result(workflow_id, JOB_RESULT_KEY))
+
+    @staticmethod
+    def _check_stale(record):
+        # Only running jobs time out: a queued job's record is untouched while it waits for a free worker.
+        if record and record['state'] == 'running' and time.time() - record['updated_at'] > JOB_STALE_SECONDS:
+            record.update(state='failed', message=f"{record['step']} was interrupted.")
+        return record
+
+    @staticmethod
+    def is_active(record):
+        return bool(record) and record['state'] in ACTIVE_STATES
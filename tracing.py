@@ -0,0 +1,111 @@
+# tracing.py
+
+import contextvars
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Histogram buckets (seconds) for span durations
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MAX_TRACE_SPANS = 200 # spans kept per workflow step; the rest are only counted in the aggregates
+
+# Spans finished while a trace() is active are appended to its list, including those
+# from worker threads started with copy_context().run (see digest_logic).
+_current_trace = contextvars.ContextVar('digest_trace', default=None)
+
+
+class Tracer:
+    """
+    Process-wide aggregates of span timings and counters, rendered in the
+    Prometheus text format by prometheus(). Span attributes named 'bytes' are
+    also summed per span, so payload sizes show up next to their timings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {} # name -> {'count', 'sum', 'buckets', 'bytes'}
+        self.counters = Counter() # (name, sorted label items) -> value
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Times the block. The yielded dict can be filled with more attributes (bytes, cache, status...)."""
+        started = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            duration = time.perf_counter() - started
+            self._observe(name, duration, attrs.get('bytes'))
+            trace = _current_trace.get()
+            if trace is not None and len(trace) < MAX_TRACE_SPANS:
+                trace.append(dict(attrs, name=name, ms=round(duration * 1000, 1)))
+
+    def count(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def _observe(self, name, duration, size=None):
+        with self._lock:
+            stats = self.spans.setdefault(name, {'count': 0, 'sum': 0.0, 'buckets': [0] * len(SPAN_BUCKETS), 'bytes': 0})
+            stats['count'] += 1
+            stats['sum'] += duration
+            for i, bound in enumerate(SPAN_BUCKETS):
+                if duration <= bound: stats['buckets'][i] += 1
+            if size: stats['bytes'] += size
+
+    def prometheus(self):
+        """Span histograms and counters in the Prometheus text exposition format."""
+        with self._lock:
+            spans = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self.spans.items()}
+            counters = dict(self.counters)
+        lines = ["# HELP digest_span_duration_seconds Duration of traced operations.", "# TYPE digest_span_duration_seconds histogram"]
+        for name, stats in sorted(spans.items()):
+            for bound, hits in zip(SPAN_BUCKETS, stats['buckets']):
+                lines.append(format_sample("digest_span_duration_seconds_bucket", hits, span=name, le=bound))
+            lines.append(format_sample("digest_span_duration_seconds_bucket", stats['count'], span=name, le="+Inf"))
+            lines.append(format_sample("digest_span_duration_seconds_sum", stats['sum'], span=name))
+            lines.append(format_sample("digest_span_duration_seconds_count", stats['count'], span=name))
+        lines += ["# HELP digest_span_bytes_total Bytes handled by traced operations.", "# TYPE digest_span_bytes_total counter"]
+        lines += [format_sample("digest_span_bytes_total", stats['bytes'], span=name) for name, stats in sorted(spans.items()) if stats['bytes']]
+        for name in sorted({name for name, _ in counters}):
+            lines += [f"# TYPE digest_{name}_total counter"]
+            lines += [format_sample(f"digest_{name}_total", value, **dict(labels)) for (counter, labels), value in sorted(counters.items()) if counter == name]
+        return "\n".join(lines) + "\n"
+
+
+def format_sample(metric, value, **labels):
+    """One Prometheus sample line, e.g. digest_http_requests_total{endpoint="page"} 3"""
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+        return f"{metric}{{{rendered}}} {value}"
+    return f"{metric} {value}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@contextmanager
+def trace():
+    """Collects every span finished inside the block (in this context) into the yielded list."""
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def summarize(spans):
+    """Per-span-name totals for a collected trace: {name: {'count', 'ms', 'bytes'}}."""
+    summary = {}
+    for span in spans:
+        entry = summary.setdefault(span['name'], {'count': 0, 'ms': 0.0, 'bytes': 0})
+        entry['count'] += 1
+        entry['ms'] = round(entry['ms'] + span['ms'], 1)
+        entry['bytes'] += span.get('bytes') or 0
+    return summary
+
+
+# Shared by digest_logic, workflow_store and app
+tracer = Tracer()
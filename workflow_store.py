@@ -0,0 +1,318 @@
+# workflow_store.py
+
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from tracing import tracer
+
+# --- Configuration ---
+# WORKFLOW_STORE selects the backend ("sqlite" or "memory").
+WORKFLOW_STORE = os.getenv("WORKFLOW_STORE", "sqlite")
+WORKFLOW_DB_PATH = os.getenv("WORKFLOW_DB_PATH", "workflows.sqlite3")
+WORKFLOW_TTL_SECONDS = int(os.getenv("WORKFLOW_TTL_SECONDS", str(7 * 24 * 3600)))
+WORKFLOW_MAX_ENTRIES = int(os.getenv("WORKFLOW_MAX_ENTRIES", "500"))
+UPDATE_LOCK_STRIPES = 64 # update_state/update_result of one workflow share one of these locks
+
+
+class WorkflowStore(abc.ABC):
+    """
+    Server-side storage for workflow state. The small state (step, prompts,
+    message) is stored as one record; each step result is stored under its
+    own key so that routes only load the results they actually need.
+    Workflows untouched for `ttl` seconds are dropped, and once more than
+    `max_entries` exist the least recently used ones are evicted.
+    Code that runs concurrently on one workflow (request threads and
+    background jobs) changes it through update_state/update_result, which
+    read and write atomically.
+    """
+
+    def __init__(self, ttl=WORKFLOW_TTL_SECONDS, max_entries=WORKFLOW_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._update_locks = [threading.Lock() for _ in range(UPDATE_LOCK_STRIPES)]
+
+    @abc.abstractmethod
+    def create(self, state):
+        """Stores a new workflow and returns its ID."""
+
+    @abc.abstractmethod
+    def load_state(self, workflow_id):
+        """Returns the workflow state, or None if it is unknown or expired."""
+
+    def save_state(self, workflow_id, state):
+        data = json.dumps(state, ensure_ascii=False)
+        with tracer.span('workflow.save_state', bytes=len(data.encode('utf-8'))):
+            self._write_state(workflow_id, data)
+
+    def update_state(self, workflow_id, fn):
+        """
+        Atomically applies fn(state), which changes the state in place. Returns
+        the new state, or None if the workflow is unknown or expired.
+        """
+        with self._atomic(workflow_id):
+            state = self.load_state(workflow_id)
+            if state is None: return None
+            fn(state)
+            self.save_state(workflow_id, state)
+            return state
+
+    @abc.abstractmethod
+    def get_result(self, workflow_id, key, default=None):
+        """Returns a stored result, or `default` if there is none."""
+
+    def set_result(self, workflow_id, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        with tracer.span('workflow.save_result', key=key, bytes=len(data.encode('utf-8'))):
+            self._write_result(workflow_id, key, data)
+
+    def update_result(self, workflow_id, key, fn, default=None):
+        """
+        Atomically replaces a result with fn(current value or `default`). When fn
+        returns None the result is left as it is. Returns the stored value.
+        """
+        with self._atomic(workflow_id):
+            value = self.get_result(workflow_id, key, default)
+            new_value = fn(value)
+            if new_value is None: return value
+            self.set_result(workflow_id, key, new_value)
+            return new_value
+
+    @contextmanager
+    def _atomic(self, workflow_id):
+        """Serializes update_state/update_result calls on the same workflow within this process."""
+        with self._update_locks[hash(workflow_id) % len(self._update_locks)]:
+            yield
+
+    @abc.abstractmethod
+    def _write_state(self, workflow_id, data):
+        """Stores the JSON-encoded state."""
+
+    @abc.abstractmethod
+    def _write_result(self, workflow_id, key, data):
+        """Stores a JSON-encoded result."""
+
+    @abc.abstractmethod
+    def clear_results(self, workflow_id, keep=()):
+        """Deletes every result of the workflow except the keys in `keep`."""
+
+    @abc.abstractmethod
+    def result_keys(self, workflow_id):
+        """Returns the keys of the workflow's stored results."""
+
+    @abc.abstractmethod
+    def delete(self, workflow_id):
+        """Removes the workflow and all of its results."""
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+
+class MemoryWorkflowStore(WorkflowStore):
+    """In-process backend. Fast, but not shared between worker processes."""
+
+    def __init__(self, ttl=WORKFLOW_TTL_SECONDS, max_entries=WORKFLOW_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self._workflows = OrderedDict() # workflow_id -> {'state', 'results', 'touched'}
+        self._lock = threading.Lock()
+
+    def _get(self, workflow_id):
+        """Returns the live entry and marks it as recently used. Caller holds the lock."""
+        entry = self._workflows.get(workflow_id)
+        if entry is None: return None
+        if time.time() - entry['touched'] > self.ttl:
+            del self._workflows[workflow_id]
+            return None
+        entry['touched'] = time.time()
+        self._workflows.move_to_end(workflow_id)
+        return entry
+
+    def _evict(self):
+        now = time.time()
+        while self._workflows:
+            oldest_id, oldest = next(iter(self._workflows.items()))
+            if len(self._workflows) <= self.max_entries and now - oldest['touched'] <= self.ttl: break
+            del self._workflows[oldest_id]
+
+    def create(self, state):
+        workflow_id = self.new_id()
+        with self._lock:
+            self._workflows[workflow_id] = {'state': json.loads(json.dumps(state)), 'results': {}, 'touched': time.time()}
+            self._evict()
+        return workflow_id
+
+    def load_state(self, workflow_id):
+        with self._lock:
+            entry = self._get(workflow_id)
+            return json.loads(json.dumps(entry['state'])) if entry else None
+
+    def _write_state(self, workflow_id, data):
+        with self._lock:
+            entry = self._get(workflow_id)
+            if entry is None:
+                entry = self._workflows[workflow_id] = {'results': {}, 'touched': time.time()}
+            entry['state'] = json.loads(data)
+            self._evict()
+
+    def get_result(self, workflow_id, key, default=None):
+        with self._lock:
+            entry = self._get(workflow_id)
+            if entry is None or key not in entry['results']: return default
+            return json.loads(entry['results'][key])
+
+    def _write_result(self, workflow_id, key, data):
+        with self._lock:
+            entry = self._get(workflow_id)
+            if entry is None: return
+            entry['results'][key] = data
+
+    def clear_results(self, workflow_id, keep=()):
+        with self._lock:
+            entry = self._get(workflow_id)
+            if entry is None: return
+            entry['results'] = {key: value for key, value in entry['results'].items() if key in keep}
+
+    def result_keys(self, workflow_id):
+        with self._lock:
+            entry = self._get(workflow_id)
+            return sorted(entry['results']) if entry else []
+
+    def delete(self, workflow_id):
+        with self._lock:
+            self._workflows.pop(workflow_id, None)
+
+
+class SQLiteWorkflowStore(WorkflowStore):
+    """SQLite backend, shared by every worker process pointing at the same file."""
+
+    def __init__(self, path=WORKFLOW_DB_PATH, ttl=WORKFLOW_TTL_SECONDS, max_entries=WORKFLOW_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self._local = threading.local() # the connection of an ongoing _atomic() block, per thread
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS workflows (id TEXT PRIMARY KEY, state TEXT NOT NULL, touched REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS workflows_touched ON workflows (touched)")
+            conn.execute("CREATE TABLE IF NOT EXISTS results (workflow_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (workflow_id, key))")
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per operation keeps the store safe to use from any thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None: # inside _atomic(): join its transaction
+            yield conn
+            return
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _atomic(self, workflow_id):
+        # BEGIN IMMEDIATE takes the database write lock up front, so the read-modify-write
+        # is also atomic against other worker processes sharing the file.
+        with super()._atomic(workflow_id):
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+            finally:
+                self._local.conn = None
+                conn.close()
+
+    def _touch(self, conn, workflow_id):
+        """Marks the workflow as recently used. Returns False if it is unknown or expired."""
+        cursor = conn.execute("UPDATE workflows SET touched = ? WHERE id = ? AND touched >= ?", (time.time(), workflow_id, time.time() - self.ttl))
+        return cursor.rowcount > 0
+
+    def _evict(self, conn):
+        conn.execute("DELETE FROM workflows WHERE touched < ?", (time.time() - self.ttl,))
+        conn.execute("DELETE FROM workflows WHERE id NOT IN (SELECT id FROM workflows ORDER BY touched DESC LIMIT ?)", (self.max_entries,))
+        conn.execute("DELETE FROM results WHERE workflow_id NOT IN (SELECT id FROM workflows)")
+
+    def create(self, state):
+        workflow_id = self.new_id()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO workflows (id, state, touched) VALUES (?, ?, ?)", (workflow_id, json.dumps(state, ensure_ascii=False), time.time()))
+            self._evict(conn)
+        return workflow_id
+
+    def load_state(self, workflow_id):
+        with self._connect() as conn:
+            if not self._touch(conn, workflow_id): return None
+            row = conn.execute("SELECT state FROM workflows WHERE id = ?", (workflow_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_state(self, workflow_id, data):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO workflows (id, state, touched) VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET state = excluded.state, touched = excluded.touched",
+                         (workflow_id, data, time.time()))
+
+    def get_result(self, workflow_id, key, default=None):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM results WHERE workflow_id = ? AND key = ?", (workflow_id, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _write_result(self, workflow_id, key, data):
+        with self._connect() as conn:
+            if not self._touch(conn, workflow_id): return
+            conn.execute("INSERT OR REPLACE INTO results (workflow_id, key, value) VALUES (?, ?, ?)", (workflow_id, key, data))
+
+    def clear_results(self, workflow_id, keep=()):
+        keep = list(keep)
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM results WHERE workflow_id = ? AND key NOT IN ({', '.join('?' * len(keep))})", (workflow_id, *keep))
+
+    def result_keys(self, workflow_id):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT key FROM results WHERE workflow_id = ? ORDER BY key", (workflow_id,))]
+
+    def delete(self, workflow_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM results WHERE workflow_id = ?", (workflow_id,))
+            conn.execute("DELETE FROM workflows WHERE id = ?", (workflow_id,))
+
+
+class LazyResults(Mapping):
+    """Read-only view of a workflow's results that loads each key on first access."""
+
+    def __init__(self, store, workflow_id):
+        self._store, self._workflow_id = store, workflow_id
+        self._keys = store.result_keys(workflow_id)
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        if key not in self._keys: raise KeyError(key)
+        if key not in self._loaded:
+            self._loaded[key] = self._store.get_result(self._workflow_id, key)
+        return self._loaded[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def make_workflow_store(backend=None):
+    """Builds the store configured by WORKFLOW_STORE."""
+    backend = backend or WORKFLOW_STORE
+    if backend == "memory": return MemoryWorkflowStore()
+    if backend == "sqlite": return SQLiteWorkflowStore()
+    raise ValueError(f"Unknown workflow store backend: {backend!r}")